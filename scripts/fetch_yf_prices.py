@@ -1,170 +1,93 @@
 #!/usr/bin/env python3
 """
 YFinance Real-Time Price Fetcher
-Only returns real market data, no fallbacks
+Only returns real market data, no fallbacks, unless PRICE_PROVIDERS selects another source
 """
 
+import os
 import sys
-import yfinance as yf
 import json
 import time
 from datetime import datetime
 
-def fetch_price_for_symbol(symbol):
+# Price sources are shared with the market data services
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'market-data'))
+from price_providers import ProviderChain
+
+# Map trading symbols to YFinance tickers
+TICKER_MAP = {
+    'EURUSD': 'EURUSD=X',
+    'GBPUSD': 'GBPUSD=X',
+    'USDJPY': 'USDJPY=X',
+    'AUDUSD': 'AUDUSD=X',
+    'USDCAD': 'USDCAD=X',
+    'USDCHF': 'USDCHF=X',
+    'NZDUSD': 'NZDUSD=X',
+    'EURGBP': 'EURGBP=X',
+    'EURJPY': 'EURJPY=X',
+    'GBPJPY': 'GBPJPY=X',
+    'GOLD': 'GC=F',
+    'SILVER': 'SI=F',
+    'BTCUSD': 'BTC-USD',
+    'ETHUSD': 'ETH-USD'
+}
+
+# Spreads for different instruments
+SPREADS = {
+    'EURUSD': 0.0002, 'GBPUSD': 0.0002, 'USDJPY': 0.02,
+    'AUDUSD': 0.0002, 'USDCAD': 0.0002, 'USDCHF': 0.0002,
+    'NZDUSD': 0.0002, 'EURGBP': 0.0002, 'EURJPY': 0.02,
+    'GBPJPY': 0.02, 'GOLD': 0.50, 'SILVER': 0.05,
+    'BTCUSD': 50.00, 'ETHUSD': 5.00
+}
+
+def fetch_price_for_symbol(symbol, prices=None):
     """Fetch real-time price for a single symbol"""
 
-    # Map trading symbols to YFinance tickers
-    ticker_map = {
-        'EURUSD': 'EURUSD=X',
-        'GBPUSD': 'GBPUSD=X',
-        'USDJPY': 'USDJPY=X',
-        'AUDUSD': 'AUDUSD=X',
-        'USDCAD': 'USDCAD=X',
-        'USDCHF': 'USDCHF=X',
-        'NZDUSD': 'NZDUSD=X',
-        'EURGBP': 'EURGBP=X',
-        'EURJPY': 'EURJPY=X',
-        'GBPJPY': 'GBPJPY=X',
-        'GOLD': 'GC=F',
-        'SILVER': 'SI=F',
-        'BTCUSD': 'BTC-USD',
-        'ETHUSD': 'ETH-USD'
-    }
-
-    # Spreads for different instruments
-    spreads = {
-        'EURUSD': 0.0002, 'GBPUSD': 0.0002, 'USDJPY': 0.02,
-        'AUDUSD': 0.0002, 'USDCAD': 0.0002, 'USDCHF': 0.0002,
-        'NZDUSD': 0.0002, 'EURGBP': 0.0002, 'EURJPY': 0.02,
-        'GBPJPY': 0.02, 'GOLD': 0.50, 'SILVER': 0.05,
-        'BTCUSD': 50.00, 'ETHUSD': 5.00
-    }
-
-    yf_ticker = ticker_map.get(symbol, symbol)
-    spread = spreads.get(symbol, 0.0002)
+    # Unlisted symbols are passed through to YFinance as tickers
+    prices = prices or ProviderChain.from_env(dict(TICKER_MAP, **{symbol: TICKER_MAP.get(symbol, symbol)}))
+    spread = SPREADS.get(symbol, 0.0002)
 
     try:
-        ticker = yf.Ticker(yf_ticker)
-
-        # Try to get 1-minute historical data first
-        hist = ticker.history(period='1d', interval='1m')
-
-        if hist.empty:
-            # If no minute data, try 5-minute interval
-            hist = ticker.history(period='5d', interval='5m')
-
-        bid = 0.0
-        ask = 0.0
-        high = 0.0
-        low = 0.0
-        volume = 0
-
-        if not hist.empty:
-            # Get the latest price
-            latest = hist.iloc[-1]
-            mid_price = float(latest['Close'])
-            day_high = float(hist['High'].max())
-            day_low = float(hist['Low'].min())
-            volume = int(hist['Volume'].sum()) if 'Volume' in hist.columns else 0
-
-            # Calculate bid/ask with spread
-            bid = mid_price - (spread / 2)
-            ask = mid_price + (spread / 2)
-
-            # Ensure high/low reflect day's range but consider current spread
-            high = day_high
-            low = day_low
-
-            # Round to appropriate decimals
-            decimals = 5
-            if 'JPY' in symbol:
-                decimals = 2
-            elif 'BTC' in symbol or 'ETH' in symbol or 'Gold' in symbol:
-                decimals = 2
-
-            bid = round(bid, decimals)
-            ask = round(ask, decimals)
-            high = round(high, decimals)
-            low = round(low, decimals)
+        quote = prices.quote(symbol)
 
+        if quote is None:
+            # If we get here, we couldn't get any price data
             return {
-                'success': True,
+                'success': False,
                 'symbol': symbol,
-                'bid': bid,
-                'ask': ask,
-                'high': high,
-                'low': low,
-                'volume': volume,
-                'timestamp': datetime.utcnow().isoformat(),
-                'source': 'yfinance_real'
+                'error': 'No price data available from YFinance',
+                'timestamp': datetime.utcnow().isoformat()
             }
-        else:
-            # If no historical data, try ticker.info
-            info = ticker.info
-
-            if 'bid' in info and 'ask' in info:
-                bid = float(info['bid'])
-                ask = float(info['ask'])
-                mid_price = (bid + ask) / 2
-
-                # Calculate high/low relative to mid
-                high = mid_price * 1.01
-                low = mid_price * 0.99
-                volume = info.get('volume', 0) or 0
-
-                # Round to appropriate decimals
-                decimals = 5
-                if 'JPY' in symbol:
-                    decimals = 2
-
-                bid = round(bid, decimals)
-                ask = round(ask, decimals)
-                high = round(high, decimals)
-                low = round(low, decimals)
-
-                return {
-                    'success': True,
-                    'symbol': symbol,
-                    'bid': bid,
-                    'ask': ask,
-                    'high': high,
-                    'low': low,
-                    'volume': volume,
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'source': 'yfinance_info'
-                }
-            elif 'regularMarketPrice' in info:
-                mid_price = float(info['regularMarketPrice'])
-                bid = mid_price - (spread / 2)
-                ask = mid_price + (spread / 2)
-                high = mid_price * 1.01
-                low = mid_price * 0.99
-                volume = info.get('averageVolume10days', 0) or 0
-
-                decimals = 2 if 'JPY' in symbol else 5
-                bid = round(bid, decimals)
-                ask = round(ask, decimals)
-                high = round(high, decimals)
-                low = round(low, decimals)
-
-                return {
-                    'success': True,
-                    'symbol': symbol,
-                    'bid': bid,
-                    'ask': ask,
-                    'high': high,
-                    'low': low,
-                    'volume': volume,
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'source': 'yfinance_market_price'
-                }
-
-        # If we get here, we couldn't get any price data
+
+        mid_price = quote['price']
+
+        # Calculate bid/ask with spread
+        bid = mid_price - (spread / 2)
+        ask = mid_price + (spread / 2)
+
+        # Day's range when the source has bars, otherwise a band around the price
+        high = quote['day_high'] if quote['day_high'] is not None else mid_price * 1.01
+        low = quote['day_low'] if quote['day_low'] is not None else mid_price * 0.99
+        volume = quote['day_volume'] or 0
+
+        # Round to appropriate decimals
+        decimals = 5
+        if 'JPY' in symbol:
+            decimals = 2
+        elif 'BTC' in symbol or 'ETH' in symbol or 'Gold' in symbol:
+            decimals = 2
+
         return {
-            'success': False,
+            'success': True,
             'symbol': symbol,
-            'error': 'No price data available from YFinance',
-            'timestamp': datetime.utcnow().isoformat()
+            'bid': round(bid, decimals),
+            'ask': round(ask, decimals),
+            'high': round(high, decimals),
+            'low': round(low, decimals),
+            'volume': volume,
+            'timestamp': datetime.utcnow().isoformat(),
+            'source': quote['source']
         }
 
     except Exception as e:
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Real-time account equity, margin and stop-out levels
+Floating P&L is maintained incrementally from position P&L deltas, so an
+account is never re-summed over all its positions on a tick
+"""
+
+import logging
+import os
+
+import numpy as np
+
+ACCOUNT_WRITE_THRESHOLD = float(os.getenv('ACCOUNT_WRITE_THRESHOLD', '0.01'))
+MARGIN_CALL_LEVEL = float(os.getenv('MARGIN_CALL_LEVEL', '100'))
+STOP_OUT_LEVEL = float(os.getenv('STOP_OUT_LEVEL', '50'))
+
+logger = logging.getLogger(__name__)
+
+
+class AccountBook:
+    """
+    Columnar balance, floating P&L and used margin per trading account
+
+    ACCOUNT_WRITE_THRESHOLD  equity change that marks an account for write-back (default 0.01)
+    MARGIN_CALL_LEVEL        margin level (%) at which a margin call is raised (default 100)
+    STOP_OUT_LEVEL           margin level (%) at which positions are closed (default 50)
+    """
+
+    def __init__(self, write_threshold=ACCOUNT_WRITE_THRESHOLD,
+                 margin_call_level=MARGIN_CALL_LEVEL, stop_out_level=STOP_OUT_LEVEL):
+        self.write_threshold = write_threshold
+        self.margin_call_level = margin_call_level
+        self.stop_out_level = stop_out_level
+        self.ids = []
+        self.index = {}
+        self.balance = np.empty(0, dtype=np.float64)
+        self.leverage = np.empty(0, dtype=np.float64)
+        self.floating = np.empty(0, dtype=np.float64)
+        self.margin = np.empty(0, dtype=np.float64)
+        self.written_equity = np.empty(0, dtype=np.float64)
+        self.dirty = np.empty(0, dtype=bool)
+        self.margin_called = np.empty(0, dtype=bool)
+
+    def load(self, rows):
+        """
+        Merge rows of (id, balance, leverage) from a sync; returns the indexes whose leverage changed
+
+        Accounts already held keep their floating P&L, used margin and write-back
+        state, so a sync only marks an account dirty when its balance moved its
+        equity past the threshold. New accounts are appended and written once.
+        """
+        known = [(self.index[row[0]], row) for row in rows if row[0] in self.index]
+        new = [row for row in rows if row[0] not in self.index]
+
+        releveraged = np.empty(0, dtype=np.intp)
+        if known:
+            idx = np.array([i for i, _ in known], dtype=np.intp)
+            leverage = np.array([float(row[2] or 100) for _, row in known], dtype=np.float64)
+            releveraged = idx[leverage != self.leverage[idx]]
+            self.balance[idx] = [float(row[1] or 0) for _, row in known]
+            self.leverage[idx] = leverage
+            self._mark(idx)
+
+        if new:
+            for row in new:
+                self.index[row[0]] = len(self.ids)
+                self.ids.append(row[0])
+            count = len(new)
+            self.balance = np.concatenate([self.balance, [float(row[1] or 0) for row in new]])
+            self.leverage = np.concatenate([self.leverage, [float(row[2] or 100) for row in new]])
+            self.floating = np.concatenate([self.floating, np.zeros(count)])
+            self.margin = np.concatenate([self.margin, np.zeros(count)])
+            self.written_equity = np.concatenate([self.written_equity, np.full(count, np.nan)])
+            self.dirty = np.concatenate([self.dirty, np.ones(count, dtype=bool)])
+            self.margin_called = np.concatenate([self.margin_called, np.zeros(count, dtype=bool)])
+        return releveraged
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add_positions(self, account_idx, profit, notional):
+        """Fold newly opened positions into floating P&L and used margin"""
+        np.add.at(self.floating, account_idx, profit)
+        np.add.at(self.margin, account_idx, notional / self.leverage[account_idx])
+        self.dirty[account_idx] = True
+
+    def set_margin(self, account_idx, margin):
+        """Replace used margin, after a leverage change"""
+        self.margin[account_idx] = margin
+        self.dirty[account_idx] = True
+
+    def position_margin(self, account_idx, notional):
+        return notional / self.leverage[account_idx]
+
+    def apply_deltas(self, account_idx, deltas):
+        """Add per-position P&L deltas; returns the indexes of accounts that moved"""
+        moved = deltas != 0
+        if not moved.any():
+            return np.empty(0, dtype=np.intp)
+        touched_idx = account_idx[moved]
+        np.add.at(self.floating, touched_idx, deltas[moved])
+        touched = np.unique(touched_idx)
+        self._mark(touched)
+        return touched
+
+    def apply_close(self, account_idx, profit, margin, realized_pnl=None):
+        """A position left the book; its P&L becomes balance once the close is booked"""
+        self.floating[account_idx] -= profit
+        self.margin[account_idx] = max(0.0, self.margin[account_idx] - margin)
+        if realized_pnl is not None:
+            self.balance[account_idx] += realized_pnl
+        self.dirty[account_idx] = True
+
+    def equity(self, idx=slice(None)):
+        return self.balance[idx] + self.floating[idx]
+
+    def margin_level(self, idx=slice(None)):
+        margin = self.margin[idx]
+        equity = self.equity(idx)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(margin > 0, equity / margin * 100.0, 0.0)
+
+    def _mark(self, idx):
+        self.dirty[idx] |= np.abs(self.equity(idx) - self.written_equity[idx]) > self.write_threshold
+        self.dirty[idx] |= np.isnan(self.written_equity[idx])
+
+    def check_levels(self, touched):
+        """Raise margin calls and return the accounts at or below the stop-out level"""
+        if len(touched) == 0:
+            return []
+        levels = self.margin_level(touched)
+        exposed = self.margin[touched] > 0
+
+        calling = touched[exposed & (levels <= self.margin_call_level)]
+        for i in calling[~self.margin_called[calling]]:
+            logger.warning("Margin call", extra={
+                'trading_account_id': self.ids[i], 'margin_level': round(float(self.margin_level(i)), 2)
+            })
+        self.margin_called[touched] = exposed & (levels <= self.margin_call_level)
+
+        return list(touched[exposed & (levels <= self.stop_out_level)])
+
+    def dirty_rows(self):
+        """Indexes, equity as held here, and (id, margin, floating) rows to write back"""
+        rows_idx = np.flatnonzero(self.dirty)
+        rows = [(self.ids[i], float(m), float(f))
+                for i, m, f in zip(rows_idx, self.margin[rows_idx], self.floating[rows_idx])]
+        return rows_idx, self.equity(rows_idx), rows
+
+    def mark_written(self, rows_idx, equity):
+        self.written_equity[rows_idx] = equity
+        self.dirty[rows_idx] = False
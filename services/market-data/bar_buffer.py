@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Fixed-size ring buffer of recent 1m bars per symbol
+Upstream fetches only need bars newer than the last one held, and the day's
+high, low and volume are maintained as bars arrive instead of recomputed
+"""
+
+import os
+
+import numpy as np
+
+BAR_BUFFER_SIZE = int(os.getenv('BAR_BUFFER_SIZE', '1440'))
+
+
+class BarRing:
+    """
+    The last `capacity` bars as parallel NumPy arrays
+
+    The newest bar may be revised while it is still forming, so a bar with the
+    same timestamp as the last one replaces it; older bars are ignored. Day
+    aggregates cover bars since 00:00 UTC of the newest bar.
+
+    Bars without a close are dropped. A missing open, high or low stays NaN and
+    is left out of the day range; a missing volume counts as zero.
+    """
+
+    def __init__(self, capacity=BAR_BUFFER_SIZE):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.open = np.zeros(capacity, dtype=np.float64)
+        self.high = np.zeros(capacity, dtype=np.float64)
+        self.low = np.zeros(capacity, dtype=np.float64)
+        self.close = np.zeros(capacity, dtype=np.float64)
+        self.volume = np.zeros(capacity, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+        self.day = None
+        self.day_high = np.nan
+        self.day_low = np.nan
+        self.day_volume = 0.0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def last_ts(self):
+        """Epoch seconds of the newest bar, or None while empty"""
+        return int(self.ts[(self.head - 1) % self.capacity]) if self.count else None
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.day = None
+        self.day_high = np.nan
+        self.day_low = np.nan
+        self.day_volume = 0.0
+
+    def extend(self, ts, open_, high, low, close, volume):
+        """Append bars given as arrays in timestamp order; returns how many were new"""
+        ts = np.asarray(ts, dtype=np.int64)
+        columns = [np.asarray(column, dtype=np.float64) for column in (open_, high, low, close, volume)]
+        columns[4] = np.nan_to_num(columns[4])
+        priced = ~np.isnan(columns[3])
+        if not priced.all():
+            ts = ts[priced]
+            columns = [column[priced] for column in columns]
+
+        if self.count:
+            last_ts = self.last_ts
+            keep = ts >= last_ts
+            ts = ts[keep]
+            columns = [column[keep] for column in columns]
+            if len(ts) and ts[0] == last_ts:
+                self._revise_last(*(column[0] for column in columns))
+                ts = ts[1:]
+                columns = [column[1:] for column in columns]
+
+        n = len(ts)
+        if n == 0:
+            return 0
+        if n > self.capacity:
+            ts = ts[-self.capacity:]
+            columns = [column[-self.capacity:] for column in columns]
+            n = self.capacity
+
+        idx = (self.head + np.arange(n)) % self.capacity
+        self.ts[idx] = ts
+        for target, column in zip((self.open, self.high, self.low, self.close, self.volume), columns):
+            target[idx] = column
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.capacity, self.count + n)
+
+        day = int(ts[-1] // 86400)
+        today = ts // 86400 == day
+        if day != self.day:
+            self.day = day
+            self.day_high = np.nan
+            self.day_low = np.nan
+            self.day_volume = 0.0
+        if today.any():
+            # fmax/fmin skip NaN, so a bar missing its high or low doesn't blank the day range
+            self.day_high = np.fmax(self.day_high, np.fmax.reduce(columns[1][today]))
+            self.day_low = np.fmin(self.day_low, np.fmin.reduce(columns[2][today]))
+            self.day_volume += float(columns[4][today].sum())
+        return n
+
+    def _revise_last(self, open_, high, low, close, volume):
+        i = (self.head - 1) % self.capacity
+        if int(self.ts[i] // 86400) == self.day:
+            self.day_volume += volume - self.volume[i]
+            self.day_high = np.fmax(self.day_high, high)
+            self.day_low = np.fmin(self.day_low, low)
+        self.open[i] = open_
+        self.high[i] = high
+        self.low[i] = low
+        self.close[i] = close
+        self.volume[i] = volume
+
+    def extend_frame(self, bars):
+        """Append an OHLCV frame with yfinance's column names and a DatetimeIndex"""
+        if bars is None or bars.empty:
+            return 0
+        # .values is UTC for tz-aware indexes; the cast copes with any stored resolution
+        ts = bars.index.values.astype('datetime64[s]').astype(np.int64)
+        volume = bars['Volume'].to_numpy() if 'Volume' in bars.columns else np.zeros(len(bars))
+        return self.extend(ts, bars['Open'].to_numpy(), bars['High'].to_numpy(),
+                           bars['Low'].to_numpy(), bars['Close'].to_numpy(), volume)
+
+    def latest(self):
+        """(ts, open, high, low, close, volume) of the newest bar, or None while empty"""
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.capacity
+        return (int(self.ts[i]), float(self.open[i]), float(self.high[i]),
+                float(self.low[i]), float(self.close[i]), float(self.volume[i]))
+
+    def bars(self):
+        """All held bars, oldest first, as a dict of arrays"""
+        order = (self.head - self.count + np.arange(self.count)) % self.capacity
+        return {
+            'ts': self.ts[order],
+            'open': self.open[order],
+            'high': self.high[order],
+            'low': self.low[order],
+            'close': self.close[order],
+            'volume': self.volume[order],
+        }
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the market data cycle and position engine
+Runs the service hot paths against a stubbed yfinance and a local Postgres
+seeded with a configurable number of open positions
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+import psycopg2
+
+import market_data_service
+import price_providers
+from bench_stats import summarize
+from market_data_service import MarketDataService, SYMBOL_MAP, DEFAULT_PRICES
+
+BENCH_SCHEMA = 'mds_bench'
+STAGES = [
+    'fetch_price',
+    'save_to_db',
+    'update_positions',
+    'check_stop_loss_take_profit',
+    'close_position',
+    'load_historical_data',
+]
+
+SCHEMA_SQL = f"""
+DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;
+CREATE SCHEMA {BENCH_SCHEMA};
+SET search_path TO {BENCH_SCHEMA};
+
+CREATE TABLE challenges (
+  id serial PRIMARY KEY,
+  account_size numeric NOT NULL,
+  profit_target numeric NOT NULL,
+  max_daily_loss numeric NOT NULL
+);
+
+CREATE TABLE user_challenges (
+  id serial PRIMARY KEY,
+  challenge_id integer NOT NULL REFERENCES challenges(id),
+  trading_account_id uuid,
+  status text NOT NULL DEFAULT 'ACTIVE',
+  current_balance numeric NOT NULL,
+  updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE trading_accounts (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  user_challenge_id integer NOT NULL REFERENCES user_challenges(id),
+  balance numeric NOT NULL,
+  equity numeric NOT NULL DEFAULT 0,
+  margin numeric NOT NULL DEFAULT 0,
+  free_margin numeric NOT NULL DEFAULT 0,
+  margin_level numeric NOT NULL DEFAULT 0,
+  leverage integer NOT NULL DEFAULT 100,
+  is_active boolean NOT NULL DEFAULT true,
+  updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE positions (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  trading_account_id uuid NOT NULL REFERENCES trading_accounts(id),
+  ticket text UNIQUE NOT NULL,
+  symbol text NOT NULL,
+  type text NOT NULL,
+  volume numeric NOT NULL,
+  open_price numeric NOT NULL,
+  current_price numeric NOT NULL,
+  stop_loss numeric,
+  take_profit numeric,
+  open_time timestamptz DEFAULT now(),
+  commission numeric DEFAULT 0,
+  swap numeric DEFAULT 0,
+  profit numeric DEFAULT 0,
+  comment text,
+  magic_number integer DEFAULT 0,
+  created_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE trades (
+  id serial PRIMARY KEY,
+  user_challenge_id integer NOT NULL,
+  symbol text NOT NULL,
+  side text NOT NULL,
+  lot_size numeric NOT NULL,
+  entry_price numeric NOT NULL,
+  exit_price numeric,
+  pnl numeric,
+  commission numeric DEFAULT 0,
+  swap numeric DEFAULT 0,
+  status text NOT NULL DEFAULT 'OPEN',
+  open_time timestamptz,
+  close_time timestamptz
+);
+
+CREATE TABLE market_data (
+  id serial PRIMARY KEY,
+  symbol text NOT NULL,
+  bid numeric NOT NULL,
+  ask numeric NOT NULL,
+  high numeric NOT NULL,
+  low numeric NOT NULL,
+  volume numeric NOT NULL,
+  timestamp timestamptz DEFAULT now()
+);
+
+CREATE INDEX idx_positions_symbol ON positions(symbol);
+CREATE INDEX idx_positions_trading_account_id ON positions(trading_account_id);
+CREATE UNIQUE INDEX idx_market_data_symbol_timestamp ON market_data(symbol, timestamp);
+"""
+
+
+class StubTicker:
+    """Stand-in for yf.Ticker that serves random-walk minute bars"""
+
+    frames = {}
+
+    def __init__(self, yf_symbol):
+        self.yf_symbol = yf_symbol
+
+    def history(self, period='1d', interval='1m', start=None, timeout=None):
+        key = (self.yf_symbol, period, interval)
+        frame = StubTicker.frames.get(key)
+        if frame is None:
+            frame = self._build_frame(period)
+            StubTicker.frames[key] = frame
+
+        # Move the latest bar so every cycle sees a fresh quote
+        last_close = frame['Close'].iat[-1]
+        frame.iloc[-1, frame.columns.get_loc('Close')] = last_close * (1 + random.gauss(0, 0.0015))
+        if start is not None:
+            return frame[frame.index >= start]
+        return frame
+
+    @property
+    def info(self):
+        return {}
+
+    def _build_frame(self, period):
+        symbol = next((s for s, t in SYMBOL_MAP.items() if t == self.yf_symbol), None)
+        defaults = DEFAULT_PRICES.get(symbol, {'bid': 100.0, 'ask': 100.0})
+        mid = (defaults['bid'] + defaults['ask']) / 2
+
+        days = int(period.rstrip('d')) if period.endswith('d') else 1
+        rows = days * 24 * 60
+        index = pd.date_range(end=datetime.utcnow(), periods=rows, freq='1min', tz='UTC')
+
+        closes = []
+        price = mid
+        for _ in range(rows):
+            price *= 1 + random.gauss(0, 0.0002)
+            closes.append(price)
+
+        return pd.DataFrame({
+            'Open': closes,
+            'High': [c * 1.0002 for c in closes],
+            'Low': [c * 0.9998 for c in closes],
+            'Close': closes,
+            'Volume': [random.randint(0, 5000) for _ in closes],
+        }, index=index)
+
+
+class StubYFinance:
+    Ticker = StubTicker
+
+
+class BenchMarketDataService(MarketDataService):
+    """MarketDataService pointed at the benchmark schema instead of Supabase"""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        super().__init__()
+
+    def connect_db(self):
+        if not self.dsn:
+            return
+        self.conn = psycopg2.connect(self.dsn, options=f'-c search_path={BENCH_SCHEMA}')
+
+
+class StageTimer:
+    """Collects wall-clock samples for wrapped service methods"""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    def wrap(self, service, stage):
+        method = getattr(service, stage)
+        samples = self.samples[stage]
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+
+        setattr(service, stage, timed)
+
+
+def seed_database(dsn, position_count, sl_tp_distance):
+    conn = psycopg2.connect(dsn)
+    cursor = conn.cursor()
+    cursor.execute(SCHEMA_SQL)
+
+    # Account ids are uuids derived from the series number so positions can reference them
+    accounts = max(1, position_count // 20)
+    cursor.execute("""
+        INSERT INTO challenges (account_size, profit_target, max_daily_loss)
+        VALUES (100000, 10000, 5000)
+    """)
+    cursor.execute("""
+        INSERT INTO user_challenges (challenge_id, trading_account_id, current_balance)
+        SELECT 1, md5('account-' || g)::uuid, 100000 FROM generate_series(1, %s) g
+    """, (accounts,))
+    cursor.execute("""
+        INSERT INTO trading_accounts (id, user_challenge_id, balance, equity, free_margin)
+        SELECT md5('account-' || g)::uuid, g, 100000, 100000, 100000 FROM generate_series(1, %s) g
+    """, (accounts,))
+
+    symbols = list(SYMBOL_MAP.keys())
+    mids = [(DEFAULT_PRICES[s]['bid'] + DEFAULT_PRICES[s]['ask']) / 2 for s in symbols]
+    cursor.execute("""
+        WITH universe AS (
+            SELECT * FROM unnest(%s::text[], %s::numeric[]) WITH ORDINALITY AS u(symbol, mid, idx)
+        )
+        INSERT INTO positions (trading_account_id, ticket, symbol, type, volume,
+                               open_price, current_price, stop_loss, take_profit)
+        SELECT
+            md5('account-' || (1 + g %% %s))::uuid,
+            'BENCH-' || g,
+            u.symbol,
+            CASE WHEN g %% 2 = 0 THEN 'BUY' ELSE 'SELL' END,
+            0.01 * (1 + g %% 100),
+            u.mid,
+            u.mid,
+            CASE WHEN g %% 2 = 0 THEN u.mid * (1 - %s * random()) ELSE u.mid * (1 + %s * random()) END,
+            CASE WHEN g %% 2 = 0 THEN u.mid * (1 + %s * random()) ELSE u.mid * (1 - %s * random()) END
+        FROM generate_series(1, %s) g
+        JOIN universe u ON u.idx = 1 + (g %% %s)
+    """, (symbols, mids, accounts, sl_tp_distance, sl_tp_distance,
+          sl_tp_distance, sl_tp_distance, position_count, len(symbols)))
+
+    conn.commit()
+    cursor.execute("ANALYZE")
+    cursor.close()
+    conn.close()
+
+
+def count_positions(service):
+    cursor = service.conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM positions")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+
+def run_scenario(dsn, position_count, cycles, history_symbols, sl_tp_distance):
+    if dsn:
+        seed_database(dsn, position_count, sl_tp_distance)
+
+    service = BenchMarketDataService(dsn)
+    timer = StageTimer()
+    for stage in STAGES:
+        timer.wrap(service, stage)
+
+    cycle_samples = []
+    positions_before = count_positions(service) if service.conn else 0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for symbol in history_symbols:
+            service.load_historical_data(symbol, days=7)
+
+        for _ in range(cycles):
+            # Defeat the 2 second re-fetch guard so every cycle hits the stub
+            service.last_update.clear()
+            start = time.perf_counter()
+            service.run_cycle()
+            cycle_samples.append(time.perf_counter() - start)
+
+    positions_after = count_positions(service) if service.conn else 0
+    if service.conn:
+        service.conn.close()
+
+    closes = positions_before - positions_after
+    close_time = sum(timer.samples['close_position'])
+    cycle_time = sum(cycle_samples)
+
+    return {
+        'positions': position_count,
+        'cycles': cycles,
+        'stages': {stage: summarize(samples) for stage, samples in timer.samples.items()},
+        'cycle': summarize(cycle_samples),
+        'closes': closes,
+        'closes_per_sec': closes / close_time if close_time else 0.0,
+        'closes_per_cycle_sec': closes / cycle_time if cycle_time else 0.0,
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for key, scenario in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(key)
+        if not previous:
+            continue
+
+        checks = [('cycle', scenario['cycle'], previous['cycle'])]
+        checks += [(stage, scenario['stages'][stage], previous['stages'].get(stage, {}))
+                   for stage in STAGES]
+        for name, current, before in checks:
+            for metric in ('p50_ms', 'p95_ms'):
+                if before.get(metric) and current.get(metric) is not None:
+                    if current[metric] > before[metric] * (1 + threshold):
+                        regressions.append(
+                            f"{key} {name} {metric}: {before[metric]:.2f} -> {current[metric]:.2f}"
+                        )
+
+        if previous.get('closes_per_sec') and scenario['closes_per_sec'] < previous['closes_per_sec'] * (1 - threshold):
+            regressions.append(
+                f"{key} closes_per_sec: {previous['closes_per_sec']:.1f} -> {scenario['closes_per_sec']:.1f}"
+            )
+    return regressions
+
+
+def print_report(results):
+    for key, scenario in results['scenarios'].items():
+        print(f"\n📊 {key}: {scenario['cycles']} cycles, {scenario['closes']} closes")
+        print(f"   {'stage':<30}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        rows = list(scenario['stages'].items()) + [('full cycle', scenario['cycle'])]
+        for name, stats in rows:
+            if not stats['count']:
+                print(f"   {name:<30}{0:>8}")
+                continue
+            print(f"   {name:<30}{stats['count']:>8}{stats['p50_ms']:>10.2f}"
+                  f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+        print(f"   closes/sec (close_position time): {scenario['closes_per_sec']:.1f}")
+        print(f"   closes/sec (cycle time):          {scenario['closes_per_cycle_sec']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the market data service hot paths')
+    parser.add_argument('--dsn', default=os.getenv('BENCH_DATABASE_URL'),
+                        help='Local Postgres DSN (default: BENCH_DATABASE_URL). '
+                             f'The {BENCH_SCHEMA} schema is dropped and recreated.')
+    parser.add_argument('--positions', default='1000,10000,100000',
+                        help='Comma separated open position counts to seed')
+    parser.add_argument('--cycles', type=int, default=5, help='Cycles to run per scenario')
+    parser.add_argument('--history-symbols', default='EURUSD,GOLD',
+                        help='Symbols to run load_historical_data for')
+    parser.add_argument('--sl-tp-distance', type=float, default=0.01,
+                        help='Max relative distance of seeded SL/TP from the open price')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the stubbed feed')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write results')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.20,
+                        help='Allowed relative regression before failing (0.20 = 20%%)')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Quotes go through the provider chain, history loads straight to yfinance
+    price_providers.yf = StubYFinance
+    market_data_service.yf = StubYFinance
+
+    if not args.dsn:
+        print("⚠️ No --dsn or BENCH_DATABASE_URL given, running without a database "
+              "(only fetch_price and load_historical_data are measured)")
+        position_counts = [0]
+    else:
+        position_counts = [int(p) for p in args.positions.split(',') if p]
+
+    history_symbols = [s for s in args.history_symbols.split(',') if s]
+
+    results = {
+        'created_at': datetime.utcnow().isoformat(),
+        'threshold': args.threshold,
+        'scenarios': {},
+    }
+    for count in position_counts:
+        print(f"🚀 Running scenario with {count} positions...")
+        scenario = run_scenario(args.dsn, count, args.cycles, history_symbols, args.sl_tp_distance)
+        results['scenarios'][f'positions_{count}'] = scenario
+
+    print_report(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"\n✅ No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Per-symbol circuit breakers for upstream price fetches
+A symbol that keeps failing (or returning empty data) is skipped for an
+exponentially growing backoff, then probed with a single half-open request
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '5'))
+
+logger = logging.getLogger(__name__)
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def call_with_timeout(function, timeout=UPSTREAM_TIMEOUT, key=None):
+    """
+    Run function() on a helper thread and raise TimeoutError if it overruns
+
+    An overrunning call can't be interrupted and keeps its thread, so each call
+    gets its own thread rather than a slot in a shared pool that hung calls
+    would fill. With a key, a new call is refused while the previous one for
+    that key is still running, which bounds hung threads to one per key.
+    """
+    with _in_flight_lock:
+        running = _in_flight.get(key)
+        if running is not None and not running.done():
+            raise TimeoutError(f"previous upstream call for {key} still running")
+        future = Future()
+        if key is not None:
+            _in_flight[key] = future
+
+    def run():
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='upstream-call', daemon=True).start()
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        raise TimeoutError(f"upstream call exceeded {timeout:.1f}s")
+
+
+class CircuitBreaker:
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.last_error = None
+        self.last_failure = None
+        self.last_success = None
+
+
+class CircuitBreakerRegistry:
+    """
+    Breakers keyed by symbol
+
+    BREAKER_FAILURE_THRESHOLD  consecutive failures before a breaker opens (default 3)
+    BREAKER_BASE_BACKOFF       seconds a breaker stays open after its first trip (default 5)
+    BREAKER_MAX_BACKOFF        cap on the doubling backoff in seconds (default 300)
+    """
+
+    def __init__(self, failure_threshold=None, base_backoff=None, max_backoff=None, clock=time.monotonic):
+        self.failure_threshold = int(
+            failure_threshold if failure_threshold is not None else os.getenv('BREAKER_FAILURE_THRESHOLD', '3'))
+        self.base_backoff = float(
+            base_backoff if base_backoff is not None else os.getenv('BREAKER_BASE_BACKOFF', '5'))
+        self.max_backoff = float(
+            max_backoff if max_backoff is not None else os.getenv('BREAKER_MAX_BACKOFF', '300'))
+        self.clock = clock
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _get(self, symbol):
+        breaker = self._breakers.get(symbol)
+        if breaker is None:
+            breaker = self._breakers[symbol] = CircuitBreaker(symbol)
+        return breaker
+
+    def allow(self, symbol):
+        """True if an upstream call for symbol may go ahead now"""
+        with self._lock:
+            breaker = self._get(symbol)
+            if breaker.state == CLOSED:
+                return True
+            if breaker.state == OPEN and self.clock() >= breaker.open_until:
+                breaker.state = HALF_OPEN
+                breaker.probe_in_flight = False
+            if breaker.state == HALF_OPEN and not breaker.probe_in_flight:
+                breaker.probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self, symbol):
+        with self._lock:
+            breaker = self._get(symbol)
+            recovered = breaker.state != CLOSED
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.trips = 0
+            breaker.probe_in_flight = False
+            breaker.last_success = datetime.utcnow()
+        if recovered:
+            logger.info("Upstream feed recovered", extra={'symbol': symbol})
+
+    def record_failure(self, symbol, error):
+        with self._lock:
+            breaker = self._get(symbol)
+            breaker.failures += 1
+            breaker.last_error = str(error)
+            breaker.last_failure = datetime.utcnow()
+            breaker.probe_in_flight = False
+            if breaker.state == CLOSED and breaker.failures < self.failure_threshold:
+                return
+
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** breaker.trips))
+            backoff *= random.uniform(0.8, 1.2)
+            breaker.trips += 1
+            breaker.state = OPEN
+            breaker.open_until = self.clock() + backoff
+        logger.warning("Upstream feed degraded, circuit opened", extra={
+            'symbol': symbol, 'failures': breaker.failures, 'retry_in_s': round(backoff, 1), 'error': str(error)
+        })
+
+    def state_value(self, symbol):
+        """Numeric state for metrics: 0 closed, 1 half-open, 2 open"""
+        breaker = self._breakers.get(symbol)
+        return STATE_VALUES[breaker.state] if breaker else 0
+
+    def snapshot(self):
+        """Breaker state for every symbol that has been seen, for operators"""
+        now = self.clock()
+        with self._lock:
+            return {
+                symbol: {
+                    'state': breaker.state,
+                    'consecutive_failures': breaker.failures,
+                    'trips': breaker.trips,
+                    'retry_in_s': round(max(0.0, breaker.open_until - now), 1) if breaker.state == OPEN else 0.0,
+                    'last_error': breaker.last_error,
+                    'last_failure': breaker.last_failure.isoformat() if breaker.last_failure else None,
+                    'last_success': breaker.last_success.isoformat() if breaker.last_success else None,
+                }
+                for symbol, breaker in self._breakers.items()
+            }
+
+    def degraded(self):
+        return sorted(symbol for symbol, breaker in self._breakers.items() if breaker.state != CLOSED)
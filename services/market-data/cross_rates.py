@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Cross rates derived from the USD majors
+A cross such as EURJPY is computed from the EURUSD and USDJPY quotes fetched
+earlier in the same cycle, instead of being fetched on its own, so it costs no
+upstream call and always agrees with its legs
+"""
+
+import logging
+import os
+import threading
+import time
+
+from metrics import Gauge
+from price_providers import PriceProvider, make_quote
+
+CROSS_RATE_SOURCE = os.getenv('CROSS_RATE_SOURCE', 'derived')
+CROSS_RATE_OVERRIDES = os.getenv('CROSS_RATE_OVERRIDES', '')
+CROSS_LEG_MAX_AGE = float(os.getenv('CROSS_LEG_MAX_AGE', '10'))
+CROSS_DIVERGENCE_BPS = float(os.getenv('CROSS_DIVERGENCE_BPS', '25'))
+CROSS_DIVERGENCE_CHECK_SECONDS = float(os.getenv('CROSS_DIVERGENCE_CHECK_SECONDS', '300'))
+
+CROSS_DIVERGENCE = Gauge(
+    'cross_rate_divergence_bps', 'Derived minus direct cross rate, in basis points of the direct rate', ['symbol'])
+
+SOURCES = ('derived', 'direct')
+
+logger = logging.getLogger(__name__)
+
+
+def cross_legs(symbols):
+    """
+    {cross: ((leg, power), (leg, power))} for every six-letter pair in symbols that
+    is not itself a USD major but whose two currencies both have one
+
+    A cross BASE/QUOTE is USD-per-BASE over USD-per-QUOTE; USD-per-C is CUSD, or
+    1/USDC, so each leg enters with power 1 or -1.
+    """
+    usd_per = {}
+    for symbol in symbols:
+        if len(symbol) != 6 or not symbol.isalpha():
+            continue
+        base, quote = symbol[:3], symbol[3:]
+        if quote == 'USD':
+            usd_per[base] = (symbol, 1)
+        elif base == 'USD':
+            usd_per[quote] = (symbol, -1)
+
+    legs = {}
+    for symbol in symbols:
+        if len(symbol) != 6 or 'USD' in (symbol[:3], symbol[3:]):
+            continue
+        base, quote = symbol[:3], symbol[3:]
+        if base in usd_per and quote in usd_per:
+            leg, power = usd_per[quote]
+            legs[symbol] = (usd_per[base], (leg, -power))
+    return legs
+
+
+def parse_sources(spec):
+    """'EURGBP=direct;GBPAUD=derived' -> {'EURGBP': 'direct', 'GBPAUD': 'derived'}"""
+    sources = {}
+    for entry in spec.split(';'):
+        if '=' not in entry:
+            continue
+        symbol, source = (part.strip() for part in entry.split('=', 1))
+        if source not in SOURCES:
+            raise ValueError(f"unknown cross rate source {source!r} for {symbol}; expected one of {SOURCES}")
+        sources[symbol.upper()] = source
+    return sources
+
+
+def _combine(a, power_a, b, power_b):
+    return (a if power_a > 0 else 1.0 / a) * (b if power_b > 0 else 1.0 / b)
+
+
+class CrossRateEngine:
+    """
+    Latest major quotes, and crosses computed from them
+
+    CROSS_RATE_SOURCE               derived or direct, for every cross (default derived)
+    CROSS_RATE_OVERRIDES            per-cross source, e.g. EURGBP=direct;GBPAUD=derived
+    CROSS_LEG_MAX_AGE               oldest leg quote a cross is derived from, in seconds (default 10)
+    CROSS_DIVERGENCE_BPS            derived vs direct gap that is logged as a warning (default 25)
+    CROSS_DIVERGENCE_CHECK_SECONDS  how often a derived cross is also fetched directly (default 300)
+
+    A cross whose legs are missing or stale is not derivable, and the provider
+    chain falls through to its direct source.
+    """
+
+    def __init__(self, symbols, default_source=CROSS_RATE_SOURCE, sources=None, max_leg_age=CROSS_LEG_MAX_AGE,
+                 divergence_bps=CROSS_DIVERGENCE_BPS, check_interval=CROSS_DIVERGENCE_CHECK_SECONDS,
+                 clock=time.monotonic):
+        if default_source not in SOURCES:
+            raise ValueError(f"unknown cross rate source {default_source!r}; expected one of {SOURCES}")
+        self.legs = cross_legs(symbols)
+        self.leg_symbols = {leg for pair in self.legs.values() for leg, _ in pair}
+        sources = sources if sources is not None else parse_sources(CROSS_RATE_OVERRIDES)
+        self.sources = {cross: sources.get(cross, default_source) for cross in self.legs}
+        self.max_leg_age = max_leg_age
+        self.divergence_bps = divergence_bps
+        self.check_interval = check_interval
+        self.clock = clock
+        self.quotes = {}
+        self.last_check = {}
+        self.diverged = set()
+        self._lock = threading.Lock()
+
+    def derived_symbols(self):
+        return [cross for cross, source in self.sources.items() if source == 'derived']
+
+    def observe(self, symbol, quote):
+        """Record a leg's latest quote; anything else is ignored"""
+        if symbol in self.leg_symbols:
+            with self._lock:
+                self.quotes[symbol] = (self.clock(), quote)
+
+    def _fresh_legs(self, symbol):
+        legs = self.legs.get(symbol)
+        if legs is None:
+            return None
+        now = self.clock()
+        with self._lock:
+            found = [self.quotes.get(leg) for leg, _ in legs]
+        if any(entry is None or now - entry[0] > self.max_leg_age for entry in found):
+            return None
+        return [(entry[1], power) for entry, (_, power) in zip(found, legs)]
+
+    def can_derive(self, symbol):
+        return self._fresh_legs(symbol) is not None
+
+    def derive(self, symbol):
+        """make_quote dict for a cross from its legs, or None if they are missing or stale"""
+        legs = self._fresh_legs(symbol)
+        if legs is None:
+            return None
+        (a, power_a), (b, power_b) = legs
+        price = _combine(a['price'], power_a, b['price'], power_b)
+
+        # Leg ranges only bound the cross's range: the highs of the two legs need not
+        # have happened at the same time. Inverted legs swap their high and low.
+        def bounds(high_key, low_key):
+            values = []
+            for quote, power in legs:
+                high, low = quote.get(high_key), quote.get(low_key)
+                if high is None or low is None:
+                    return None, None
+                values.append((high, low) if power > 0 else (low, high))
+            (high_a, low_a), (high_b, low_b) = values
+            high = _combine(high_a, power_a, high_b, power_b)
+            low = _combine(low_a, power_a, low_b, power_b)
+            return max(high, price), min(low, price)
+
+        bar_high, bar_low = bounds('bar_high', 'bar_low')
+        day_high, day_low = bounds('day_high', 'day_low')
+        return make_quote(price, bar_high, bar_low, 0, day_high, day_low, 0, 'derived')
+
+    def check_due(self, symbol):
+        """Whether a derived cross should also be fetched directly for comparison"""
+        with self._lock:
+            if self.clock() - self.last_check.get(symbol, float('-inf')) < self.check_interval:
+                return False
+            self.last_check[symbol] = self.clock()
+            return True
+
+    def record_divergence(self, symbol, derived_price, direct_price):
+        """Export the gap between the two sources and warn when it crosses the threshold"""
+        if not direct_price:
+            return None
+        bps = (derived_price - direct_price) / direct_price * 10000
+        CROSS_DIVERGENCE.labels(symbol=symbol).set(bps)
+        if abs(bps) >= self.divergence_bps:
+            if symbol not in self.diverged:
+                self.diverged.add(symbol)
+                logger.warning("Derived cross rate diverges from direct quote", extra={
+                    'symbol': symbol, 'derived': derived_price, 'direct': direct_price, 'bps': round(bps, 2),
+                })
+        elif symbol in self.diverged:
+            self.diverged.discard(symbol)
+            logger.info("Derived cross rate back in line with direct quote", extra={'symbol': symbol, 'bps': round(bps, 2)})
+        return bps
+
+
+class DerivedProvider(PriceProvider):
+    """Crosses from a CrossRateEngine; only supports a cross while its legs are fresh"""
+
+    name = 'derived'
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def supports(self, symbol):
+        return self.engine.can_derive(symbol)
+
+    def quote(self, symbol):
+        return self.engine.derive(symbol)
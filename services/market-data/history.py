@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Downsampled price history for charts
+The database keeps only the lowest and highest tick of each fine time bucket,
+so a range returns a bounded number of rows. Those are thinned to at most the
+requested number of points with shape-preserving downsampling in NumPy, and
+results are cached per bucket-aligned range
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+import psycopg2
+
+HISTORY_DSN = os.getenv('HISTORY_DSN') or os.getenv('QUOTE_FEED_DSN')
+HISTORY_DEFAULT_POINTS = int(os.getenv('HISTORY_DEFAULT_POINTS', '500'))
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', '5000'))
+HISTORY_DEFAULT_RANGE_SECONDS = float(os.getenv('HISTORY_DEFAULT_RANGE_SECONDS', '86400'))
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', '256'))
+HISTORY_SETTLE_SECONDS = float(os.getenv('HISTORY_SETTLE_SECONDS', '60'))
+HISTORY_MAX_ROWS = int(os.getenv('HISTORY_MAX_ROWS', '50000'))
+
+METHODS = ('minmax', 'lttb')
+
+logger = logging.getLogger(__name__)
+
+
+def parse_time(value):
+    """Epoch seconds or an ISO 8601 string (naive means UTC) -> epoch seconds"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    if not math.isfinite(seconds):
+        raise ValueError(f"time must be finite, got {value!r}")
+    return seconds
+
+
+def _first_per_segment(mask, segment):
+    """Index of the first True in mask within each segment that has one"""
+    hits = np.flatnonzero(mask)
+    seg = segment[hits]
+    return hits[np.r_[True, seg[1:] != seg[:-1]]] if len(hits) else hits
+
+
+def minmax_indices(ts, values, buckets, start, end):
+    """
+    Indices of the lowest and highest value in each of `buckets` equal time
+    buckets over [start, end); ts must be sorted. Empty buckets add nothing, so
+    gaps such as weekends stay gaps.
+    """
+    n = len(ts)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    width = (end - start) / buckets
+    bucket = np.clip(((ts - start) / width).astype(np.int64), 0, buckets - 1)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    picked = np.concatenate([_first_per_segment(values == lows[segment], segment),
+                             _first_per_segment(values == highs[segment], segment)])
+    return np.unique(picked)
+
+
+def lttb_indices(ts, values, points):
+    """
+    Largest-Triangle-Three-Buckets over equal-count buckets
+
+    Each bucket's choice depends on the previous one, so buckets are visited in
+    a loop (at most `points` iterations); the triangle areas within a bucket and
+    the bucket averages are computed with array operations.
+    """
+    n = len(ts)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x = ts - ts[0]
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    avg_y = np.add.reduceat(values[1:n - 1], edges[:-1] - 1) / counts
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i < points - 3:
+            next_x, next_y = avg_x[i + 1], avg_y[i + 1]
+        else:
+            next_x, next_y = x[-1], values[-1]
+        area = np.abs((x[a] - next_x) * (values[lo:hi] - values[a])
+                      - (x[a] - x[lo:hi]) * (next_y - values[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+class HistoryStore:
+    """
+    Reads market_data over its own connection and caches downsampled ranges
+
+    HISTORY_DSN                    database to read from (default QUOTE_FEED_DSN)
+    HISTORY_DEFAULT_POINTS         points when the request does not say (default 500)
+    HISTORY_MAX_POINTS             most points a request may ask for (default 5000)
+    HISTORY_DEFAULT_RANGE_SECONDS  range when `from` is missing (default 86400)
+    HISTORY_CACHE_SIZE             cached ranges, least recently used evicted first (default 256)
+    HISTORY_SETTLE_SECONDS         ranges ending this long ago no longer change (default 60)
+    HISTORY_MAX_ROWS               most rows one range reads from the database (default 50000)
+
+    Range ends are rounded down to the bucket width, so clients asking for "the
+    last week" a few seconds apart share one cached result. A range that is not
+    settled yet expires after one bucket width.
+    """
+
+    def __init__(self, dsn=HISTORY_DSN, cache_size=HISTORY_CACHE_SIZE, settle_seconds=HISTORY_SETTLE_SECONDS,
+                 clock=time.time):
+        self.dsn = dsn
+        self.cache_size = cache_size
+        self.settle_seconds = settle_seconds
+        self.clock = clock
+        self.cache = OrderedDict()
+        self.conn = None
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """A store for HISTORY_DSN, or None if no database is configured"""
+        return cls() if HISTORY_DSN else None
+
+    def normalize(self, start, end, points):
+        """Clamp a request to the limits and align it to its bucket width"""
+        for value in (start, end):
+            if value is not None and not math.isfinite(value):
+                raise ValueError(f"time must be finite, got {value!r}")
+        now = self.clock()
+        end = min(now, end if end is not None else now)
+        start = start if start is not None else end - HISTORY_DEFAULT_RANGE_SECONDS
+        if start >= end:
+            raise ValueError("'from' must be before 'to'")
+        points = max(3, min(HISTORY_MAX_POINTS, points or HISTORY_DEFAULT_POINTS))
+        width = (end - start) / points
+        aligned_end = (end // width) * width if width >= 1 else end
+        return aligned_end - (end - start), aligned_end, points
+
+    def get(self, symbol, start=None, end=None, points=None, method='minmax'):
+        """(result dict, cache hit) for symbol between start and end (epoch seconds)"""
+        if method not in METHODS:
+            raise ValueError(f"unknown method {method!r}; expected one of {METHODS}")
+        start, end, points = self.normalize(start, end, points)
+        key = (symbol, start, end, points, method)
+        now = self.clock()
+        with self._lock:
+            cached = self.cache.get(key)
+            if cached is not None and (cached[0] is None or now < cached[0]):
+                self.cache.move_to_end(key)
+                return cached[1], True
+
+        ts, bid, ask, source_points = self.load(symbol, start, end, points // 2)
+        mid = (bid + ask) / 2
+        if method == 'lttb':
+            picked = lttb_indices(ts, mid, points)
+        else:
+            picked = minmax_indices(ts, mid, points // 2, start, end)
+        result = {
+            'symbol': symbol,
+            'from': start,
+            'to': end,
+            'method': method,
+            'source_points': source_points,
+            'points': len(picked),
+            't': ts[picked].tolist(),
+            'bid': bid[picked].tolist(),
+            'ask': ask[picked].tolist(),
+        }
+
+        settled = end <= now - self.settle_seconds
+        expires = None if settled else now + max(1.0, (end - start) / points)
+        with self._lock:
+            self.cache[key] = (expires, result)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result, False
+
+    def load(self, symbol, start, end, buckets):
+        """
+        (ts, bid, ask, ticks in range) for [start, end), oldest first
+
+        The range is split into a multiple of `buckets` equal time buckets, as
+        many as HISTORY_MAX_ROWS allows, and only the first lowest and first
+        highest mid of each comes back. Every bucket of the caller lies on whole
+        fine buckets, so its minimum and maximum are among the rows returned.
+        """
+        fine = buckets * max(1, HISTORY_MAX_ROWS // (2 * buckets))
+        width = (end - start) / fine
+        with self._db_lock:
+            for attempt in range(2):
+                try:
+                    if self.conn is None or self.conn.closed:
+                        self.conn = psycopg2.connect(self.dsn)
+                        self.conn.set_session(readonly=True, autocommit=True)
+                    cursor = self.conn.cursor()
+                    try:
+                        cursor.execute("""
+                            SELECT extract(epoch FROM timestamp)::float8, bid::float8, ask::float8, ticks
+                            FROM (
+                                SELECT timestamp, bid, ask, count(*) OVER () AS ticks,
+                                       row_number() OVER (PARTITION BY bucket ORDER BY mid, timestamp) AS low,
+                                       row_number() OVER (PARTITION BY bucket ORDER BY mid DESC, timestamp) AS high
+                                FROM (
+                                    SELECT timestamp, bid, ask, (bid + ask) / 2 AS mid,
+                                           least(floor((extract(epoch FROM timestamp) - %(start)s) / %(width)s),
+                                                 %(last)s) AS bucket
+                                    FROM market_data
+                                    WHERE symbol = %(symbol)s
+                                      AND timestamp >= to_timestamp(%(start)s) AND timestamp < to_timestamp(%(end)s)
+                                ) ticks
+                            ) ranked
+                            WHERE low = 1 OR high = 1
+                            ORDER BY timestamp
+                        """, {'symbol': symbol, 'start': start, 'end': end, 'width': width, 'last': fine - 1})
+                        rows = cursor.fetchall()
+                    finally:
+                        cursor.close()
+                    break
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    # A dropped connection gets one retry on a fresh one
+                    logger.warning("History query failed", extra={'symbol': symbol, 'error': str(e)})
+                    if self.conn is not None:
+                        self.conn.close()
+                    self.conn = None
+                    if attempt:
+                        raise
+        if not rows:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty, empty, 0
+        data = np.array(rows, dtype=np.float64)
+        return data[:, 0], data[:, 1], data[:, 2], int(rows[0][3])
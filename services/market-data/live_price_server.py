@@ -4,14 +4,42 @@ Live Price Server using YFinance for real-time market data
 Provides real-time Forex, Commodities, and Crypto prices
 """
 
-import yfinance as yf
 import json
 import time
 from datetime import datetime
 import threading
 import os
+import queue
 import sys
+import logging
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+import quote_codec
+from circuit_breaker import CircuitBreakerRegistry
+from history import HistoryStore, parse_time
+from metrics import Counter, Gauge, Histogram
+from price_providers import ProviderChain
+from quote_feed import QuoteSubscriber, QUOTE_FEED_MAX_AGE
+from quote_record import Quote, QuoteSnapshot
+from structured_logging import setup_logging
+from subscriptions import SubscriptionRegistry
+from warm_start import WarmStart
+
+logger = logging.getLogger('live_price')
+tick_log = logging.getLogger('live_price.tick')
+
+UPSTREAM_FETCH_SECONDS = Histogram(
+    'upstream_fetch_seconds', 'Latency of upstream price fetches', ['symbol'])
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds', 'Latency of HTTP requests', ['endpoint'])
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Quote cache lookups by result', ['cache', 'result'])
+QUEUE_DEPTH = Gauge(
+    'queue_depth', 'Items waiting to be processed', ['queue'])
+CIRCUIT_STATE = Gauge(
+    'circuit_state', 'Upstream circuit breaker state (0 closed, 1 half-open, 2 open)', ['symbol'])
 
 class PriceHandler(BaseHTTPRequestHandler):
     def __init__(self, price_service, *args, **kwargs):
@@ -19,7 +47,39 @@ class PriceHandler(BaseHTTPRequestHandler):
         super().__init__(*args, **kwargs)
 
     def do_GET(self):
+        in_flight = QUEUE_DEPTH.labels(queue='http_in_flight')
+        in_flight.inc()
         try:
+            with HTTP_REQUEST_SECONDS.labels(endpoint=self.get_endpoint_label()).time():
+                self.handle_get()
+        finally:
+            in_flight.dec()
+
+    def get_endpoint_label(self):
+        """Collapse per-symbol paths so label cardinality stays bounded"""
+        path = self.path.split('?')[0]
+        if path.startswith('/api/prices/'):
+            return '/api/prices/<symbol>'
+        if path.startswith('/api/history/'):
+            return '/api/history/<symbol>'
+        if path in ('/api/prices', '/api/symbols', '/api/feeds', '/health', '/metrics'):
+            return path
+        return 'other'
+
+    def handle_get(self):
+        try:
+            if self.path.split('?')[0] == '/metrics':
+                self.send_metrics_response()
+                return
+
+            if self.path.startswith('/api/prices') and self.wants_binary():
+                self.handle_binary_prices()
+                return
+
+            if self.path.startswith('/api/history/'):
+                self.handle_history()
+                return
+
             # Handle CORS
             self.send_cors_headers()
 
@@ -27,48 +87,111 @@ class PriceHandler(BaseHTTPRequestHandler):
                 # Extract symbol from query
                 symbol = self.get_symbol_from_path()
                 if symbol:
+                    self.price_service.subscriptions.touch(symbol)
                     price_data = self.price_service.get_price(symbol)
                     if price_data:
-                        response = {
-                            'symbol': symbol,
-                            'bid': price_data['bid'],
-                            'ask': price_data['ask'],
-                            'high': price_data['high'],
-                            'low': price_data['low'],
-                            'timestamp': price_data['timestamp'].isoformat(),
-                            'volume': price_data.get('volume', 0),
-                            'last_update': datetime.utcnow().isoformat()
-                        }
+                        response = price_data.to_dict(symbol)
+                        response['last_update'] = datetime.utcnow().isoformat()
                         self.send_json_response(response)
                     else:
                         self.send_error_response("Symbol not found", 404)
                 else:
-                    # Return all symbols
-                    all_prices = self.price_service.get_all_prices()
+                    # Return all symbols, or just the ones asked for with ?symbols=EURUSD,GBPUSD;
+                    # either way the client is watching every symbol it gets back
+                    symbols = self.get_requested_symbols()
+                    for requested in symbols or self.price_service.symbol_map:
+                        self.price_service.subscriptions.touch(requested)
+                    all_prices = self.price_service.get_all_prices(symbols)
                     all_response = {
                         'prices': all_prices,
                         'timestamp': datetime.utcnow().isoformat()
                     }
                     self.send_json_response(all_response)
+            elif self.path == '/api/symbols':
+                self.send_json_response({'symbols': quote_codec.symbol_table()})
+            elif self.path == '/api/feeds':
+                breakers = self.price_service.breakers
+                self.send_json_response({
+                    'feeds': breakers.snapshot(),
+                    'degraded': breakers.degraded(),
+                    'timestamp': datetime.utcnow().isoformat()
+                })
             elif self.path == '/health':
                 self.send_json_response({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
             else:
                 self.send_error_response("Endpoint not found", 404)
 
         except Exception as e:
-            print(f"Error handling request: {e}")
+            logger.exception("Error handling request", extra={'path': self.path})
             self.send_error_response("Internal server error", 500)
 
+    def wants_binary(self):
+        """?format=binary, or an Accept header asking for quote records, selects the binary protocol"""
+        formats = parse_qs(urlparse(self.path).query).get('format')
+        if formats:
+            return formats[-1] == 'binary'
+        return quote_codec.CONTENT_TYPE in self.headers.get('Accept', '')
+
+    def handle_binary_prices(self):
+        symbol = self.get_symbol_from_path()
+        if symbol:
+            self.price_service.subscriptions.touch(symbol)
+            price_data = self.price_service.get_price(symbol)
+            if not price_data:
+                self.send_error_response("Symbol not found", 404)
+                return
+            quotes = [(symbol, price_data)]
+        else:
+            symbols = self.get_requested_symbols()
+            for requested in symbols or self.price_service.symbol_map:
+                self.price_service.subscriptions.touch(requested)
+            quotes = QuoteSnapshot.from_quotes(self.price_service.get_all_quotes(symbols).items())
+
+        body = quote_codec.encode_snapshot(quotes)
+        self.send_cors_headers(content_type=quote_codec.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_history(self):
+        """/api/history/<symbol>?from=&to=&points=&method=, downsampled to at most points samples"""
+        history = self.price_service.history
+        if history is None:
+            self.send_error_response("History is not configured (set HISTORY_DSN)", 503)
+            return
+        symbol = urlparse(self.path).path.split('/')[3].upper()
+        if symbol not in self.price_service.symbol_map:
+            self.send_error_response("Symbol not found", 404)
+            return
+        params = {key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+        try:
+            start = parse_time(params['from']) if 'from' in params else None
+            end = parse_time(params['to']) if 'to' in params else None
+            points = int(params['points']) if 'points' in params else None
+            result, hit = history.get(symbol, start, end, points, params.get('method', 'minmax'))
+        except ValueError as e:
+            self.send_error_response(str(e), 400)
+            return
+        CACHE_REQUESTS.labels(cache='history', result='hit' if hit else 'miss').inc()
+        self.send_cors_headers()
+        self.send_json_response(result)
+
+    def log_message(self, format, *args):
+        """Send the access log through the queue instead of writing to stderr"""
+        if tick_log.isEnabledFor(logging.DEBUG):
+            tick_log.debug(format % args, extra={'client': self.client_address[0]})
+
     def do_OPTIONS(self):
         self.send_cors_headers()
         self.end_headers()
 
-    def send_cors_headers(self):
+    def send_cors_headers(self, content_type='application/json'):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Vary', 'Accept')
 
     def send_json_response(self, data):
         response = json.dumps(data).encode('utf-8')
@@ -76,6 +199,14 @@ class PriceHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(response)
 
+    def send_metrics_response(self):
+        body = metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def send_error_response(self, message, status_code=400):
         error_data = {'error': message, 'timestamp': datetime.utcnow().isoformat()}
         self.send_response(status_code)
@@ -85,9 +216,15 @@ class PriceHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(response)
 
+    def get_requested_symbols(self):
+        values = parse_qs(urlparse(self.path).query).get('symbols')
+        if not values:
+            return None
+        return [symbol.strip().upper() for value in values for symbol in value.split(',') if symbol.strip()]
+
     def get_symbol_from_path(self):
         """Extract symbol from URL path like /api/prices/EURUSD"""
-        parts = self.path.split('/')
+        parts = self.path.split('?')[0].split('/')
         if len(parts) >= 4 and parts[1] == 'api' and parts[2] == 'prices':
             return parts[3].upper()
         return None
@@ -146,123 +283,160 @@ class YFinancePriceService:
 
         self.price_cache = {}
         self.last_update = {}
+        # Quotes pushed by market_data_service over LISTEN/NOTIFY, when QUOTE_FEED_DSN is set
+        self.subscriber = QuoteSubscriber.from_env()
+        if self.subscriber:
+            self.subscriber.start()
+        # Symbols clients asked for recently are refreshed on every cache expiry, the rest slowly
+        self.subscriptions = SubscriptionRegistry()
+        interest_dsn = os.getenv('INTEREST_DSN', os.getenv('QUOTE_FEED_DSN'))
+        if interest_dsn:
+            self.subscriptions.start_publisher(interest_dsn)
+        # Downsampled history is read straight from market_data, when a database is configured
+        self.history = HistoryStore.from_env()
+        self.breakers = CircuitBreakerRegistry()
+        self.prices = ProviderChain.from_env(self.symbol_map, breakers=self.breakers)
+        for symbol in self.symbol_map:
+            CIRCUIT_STATE.labels(symbol=symbol).set_function(
+                lambda symbol=symbol: self.prices.state_value(symbol))
         self.decimal_places = {
             'BTCUSD': 2, 'ETHUSD': 2, 'BNBUSD': 2, 'ADAUSD': 2, 'XRPUSD': 4,
             'USDJPY': 2, 'EURJPY': 2, 'GBPJPY': 2, 'AUDJPY': 2, 'GOLD': 2,
             'SILVER': 2, 'OIL': 2, 'SPX500': 2, 'NASDAQ': 2
         }
+        # Quotes, bar rings and interest from before a restart, so the first requests skip upstream.
+        # A restored quote is served as it is once, and refreshed on a background thread meanwhile.
+        self.restored = set()
+        self.refresh_queued = set()
+        self.refresh_queue = queue.Queue()
+        self.warm_start = WarmStart.for_service('live_price')
+        if self.warm_start is not None:
+            try:
+                self.warm_start.restore(self.price_cache, self.last_update, self.prices, self.subscriptions)
+            except Exception as e:
+                logger.warning("Error restoring warm-start snapshot", extra={'error': str(e)})
+            self.restored.update(self.price_cache)
+        if self.restored:
+            QUEUE_DEPTH.labels(queue='warm_refresh').set_function(self.refresh_queue.qsize)
+            threading.Thread(target=self._refresh_restored, name='warm-refresh', daemon=True).start()
+
+    def _refresh_restored(self):
+        """Replace restored quotes from upstream, one symbol at a time, off the serving thread"""
+        while True:
+            symbol = self.refresh_queue.get()
+            try:
+                self.fetch_price(symbol)
+            finally:
+                self.restored.discard(symbol)
+
+    def save_warm_start(self, force=False):
+        if self.warm_start is None or not (force or self.warm_start.due()):
+            return
+        try:
+            self.warm_start.save(self.price_cache, self.last_update, self.prices, self.subscriptions)
+        except Exception as e:
+            logger.warning("Error saving warm-start snapshot", extra={'error': str(e)})
 
     def get_price(self, symbol):
         """Get real-time price for a symbol"""
         try:
             if symbol not in self.symbol_map:
-                print(f"Symbol {symbol} not supported")
+                tick_log.info("Symbol not supported", extra={'symbol': symbol})
                 return None
 
-            yf_symbol = self.symbol_map[symbol]
-            spread = self.spreads[symbol]
-
             # Check if we have cached data (within 5 seconds)
             now = time.time()
             if symbol in self.last_update and now - self.last_update[symbol] < 5:
+                CACHE_REQUESTS.labels(cache='price', result='hit').inc()
                 return self.price_cache[symbol]
 
-            try:
-                # Fetch data from YFinance
-                ticker = yf.Ticker(yf_symbol)
-                data = ticker.history(period='1d', interval='1m')
-
-                if data.empty:
-                    # If no data, try a different interval
-                    data = ticker.history(period='5d', interval='5m')
-
-                if data.empty:
-                    # Fallback to basic info
-                    try:
-                        info = ticker.info
-                        if 'bid' in info and 'ask' in info:
-                            mid_price = (info['bid'] + info['ask']) / 2
-                        elif 'currentPrice' in info:
-                            mid_price = info['currentPrice']
-                        elif 'regularMarketPrice' in info:
-                            mid_price = info['regularMarketPrice']
-                        else:
-                            print(f"No price data available for {symbol}")
-                            return None
-
-                        bid = mid_price - spread / 2
-                        ask = mid_price + spread / 2
-
-                    except Exception as e:
-                        print(f"Error getting info for {symbol}: {e}")
-                        return None
-                else:
-                    # Get latest price from historical data
-                    latest = data.iloc[-1]
-                    mid_price = float(latest['Close'])
-
-                    bid = mid_price - spread / 2
-                    ask = mid_price + spread / 2
-
-                # Round to appropriate decimal places
-                decimals = self.decimal_places.get(symbol, 5)
-                bid = round(bid, decimals)
-                ask = round(ask, decimals)
-
-                # Calculate high/low for the day
-                if not data.empty:
-                    day_high = float(data['High'].max())
-                    day_low = float(data['Low'].min())
-                    volume = int(data['Volume'].sum()) if 'Volume' in data.columns else 0
-                else:
-                    day_high = ask
-                    day_low = bid
-                    volume = 0
-
-                price_data = {
-                    'bid': bid,
-                    'ask': ask,
-                    'high': day_high,
-                    'low': day_low,
-                    'volume': volume,
-                    'timestamp': datetime.utcnow()
-                }
-
-                # Cache the result
-                self.price_cache[symbol] = price_data
-                self.last_update[symbol] = now
-
-                print(f"✅ Updated {symbol}: {bid:.5f}/{ask:.5f} ({volume} vol)")
-                return price_data
-
-            except Exception as e:
-                print(f"❌ Error fetching {symbol} from YFinance: {e}")
-
-                # Return fallback price if available
-                if symbol in self.price_cache:
-                    return self.price_cache[symbol]
-                return None
+            if self.subscriber:
+                pushed = self.subscriber.get(symbol, max_age=QUOTE_FEED_MAX_AGE)
+                if pushed:
+                    CACHE_REQUESTS.labels(cache='price', result='push').inc()
+                    return pushed
+
+            if symbol in self.restored:
+                # Still the quote from the snapshot: answer with it now, and have it refreshed once
+                if symbol not in self.refresh_queued:
+                    self.refresh_queued.add(symbol)
+                    self.refresh_queue.put(symbol)
+                CACHE_REQUESTS.labels(cache='price', result='restored').inc()
+                return self.price_cache[symbol]
+            CACHE_REQUESTS.labels(cache='price', result='miss').inc()
+            return self.fetch_price(symbol)
 
         except Exception as e:
-            print(f"❌ Error in get_price for {symbol}: {e}")
+            tick_log.error("Error in get_price", extra={'symbol': symbol, 'error': str(e)})
             return None
 
-    def get_all_prices(self):
-        """Get prices for all supported symbols"""
-        all_prices = {}
-        for symbol in self.symbol_map.keys():
-            price = self.get_price(symbol)
+    def fetch_price(self, symbol):
+        """Quote symbol from upstream and cache it; the cached quote, if any, when upstream fails"""
+        try:
+            # Providers fail over in order; dead ones are skipped until their breaker lets a probe through
+            with UPSTREAM_FETCH_SECONDS.labels(symbol=symbol).time():
+                quote = self.prices.quote(symbol)
+
+            if quote is None:
+                tick_log.warning("No price data available", extra={'symbol': symbol})
+                return self.price_cache.get(symbol)
+
+            now = time.time()
+            spread = self.spreads[symbol]
+            mid_price = quote['price']
+            bid = mid_price - spread / 2
+            ask = mid_price + spread / 2
+
+            # Round to appropriate decimal places
+            decimals = self.decimal_places.get(symbol, 5)
+            bid = round(bid, decimals)
+            ask = round(ask, decimals)
+
+            # High/low for the day, when the source reports them
+            day_high = quote['day_high'] if quote['day_high'] is not None else ask
+            day_low = quote['day_low'] if quote['day_low'] is not None else bid
+            volume = quote['day_volume'] or 0
+
+            price_data = Quote(bid, ask, day_high, day_low, volume, now)
+
+            # Cache the result
+            self.price_cache[symbol] = price_data
+            self.last_update[symbol] = now
+
+            if tick_log.isEnabledFor(logging.INFO):
+                tick_log.info("Updated price", extra={'symbol': symbol, 'bid': bid, 'ask': ask, 'volume': volume})
+            return price_data
+
+        except Exception as e:
+            tick_log.warning("Error fetching price", extra={'symbol': symbol, 'error': str(e)})
+
+            # Return fallback price if available
+            return self.price_cache.get(symbol)
+
+    def get_all_prices(self, symbols=None):
+        """Get prices for all supported symbols, or the given ones"""
+        return QuoteSnapshot.from_quotes(self.get_all_quotes(symbols).items()).to_dicts()
+
+    def get_all_quotes(self, symbols=None):
+        """Latest Quote record per symbol, as cached"""
+        all_quotes = {}
+        now = time.time()
+        symbols = [symbol for symbol in symbols or self.symbol_map.keys() if symbol in self.symbol_map]
+        # Majors first, so crosses can be derived from them
+        for symbol in self.prices.fetch_order(symbols):
+            if symbol in self.price_cache and not self.subscriptions.due(symbol, now - self.last_update[symbol]):
+                # Idle symbol: serve the cached quote until its slow refresh is due
+                CACHE_REQUESTS.labels(cache='price', result='idle').inc()
+                price = self.price_cache[symbol]
+            else:
+                price = self.get_price(symbol)
             if price:
-                all_prices[symbol] = {
-                    'symbol': symbol,
-                    **price,
-                    'timestamp': price['timestamp'].isoformat()
-                }
-        return all_prices
+                all_quotes[symbol] = price
+        return {symbol: all_quotes[symbol] for symbol in symbols if symbol in all_quotes}
 
 def run_server():
     price_service = YFinancePriceService()
-    port = 8888
+    port = int(os.getenv('LIVE_PRICE_PORT', '8888'))
 
     # Create handler factory
     def handler_factory():
@@ -275,23 +449,34 @@ def run_server():
         def __init__(self, *args, **kwargs):
             super().__init__(price_service, *args, **kwargs)
 
-    httpd = HTTPServer(server_address, PriceHandlerWithService)
+    class PriceServer(HTTPServer):
+        def service_actions(self):
+            # Runs between requests on the serving thread, so caches aren't read mid-update
+            price_service.save_warm_start()
 
-    print("🚀 YFinance Live Price Server Starting...")
-    print(f"📊 Supporting {len(price_service.symbol_map)} symbols")
-    print(f"🌐 Server running on http://localhost:{port}")
-    print("📡 Endpoints:")
-    print(f"   GET /api/prices -> Get all prices")
-    print(f"   GET /api/prices/EURUSD -> Get EURUSD price")
-    print(f"   GET /health -> Health check")
-    print("🛑 Press Ctrl+C to stop\n")
+    httpd = PriceServer(server_address, PriceHandlerWithService)
+
+    logger.info("YFinance Live Price Server started", extra={
+        'symbols': len(price_service.symbol_map),
+        'url': f"http://localhost:{port}",
+        'endpoints': ['/api/prices', '/api/prices/<symbol>', '/api/history/<symbol>', '/api/symbols',
+                      '/api/feeds', '/health', '/metrics'],
+    })
 
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped")
+        logger.info("Server stopped")
         httpd.shutdown()
+    finally:
+        price_service.save_warm_start(force=True)
 
 
 if __name__ == '__main__':
-    run_server()
+    log_handle = setup_logging('live_price')
+    QUEUE_DEPTH.labels(queue='log').set_function(log_handle.queue_depth)
+    Gauge('log_records_dropped', 'Log records dropped because the log queue was full').set_function(log_handle.dropped)
+    try:
+        run_server()
+    finally:
+        log_handle.stop()
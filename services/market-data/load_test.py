@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Load generator for live_price_server.py
+Starts the server with the synthetic price source (or targets a running one),
+drives it with concurrent clients and a weighted request mix for a fixed
+duration, and reports throughput, error rate and latency percentiles
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from bench_stats import summarize
+
+SYMBOLS = ['EURUSD', 'GBPUSD', 'USDJPY', 'EURJPY', 'GOLD', 'OIL', 'SPX500', 'BTCUSD', 'ETHUSD']
+
+ENDPOINTS = {
+    'prices': lambda rng: '/api/prices',
+    'symbol': lambda rng: f'/api/prices/{rng.choice(SYMBOLS)}',
+    'binary': lambda rng: '/api/prices?format=binary',
+    'health': lambda rng: '/health',
+}
+
+
+def parse_mix(spec):
+    """'prices=2,symbol=6,health=2' -> [('prices', 2.0), ('symbol', 6.0), ('health', 2.0)]"""
+    mix = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        name, _, weight = entry.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint {name!r}; available: {sorted(ENDPOINTS)}")
+        mix.append((name, float(weight or 1)))
+    if not mix or sum(weight for _, weight in mix) <= 0:
+        raise ValueError("the request mix needs at least one endpoint with a positive weight")
+    return mix
+
+
+def parse_env(pairs):
+    """['KEY=VALUE', ...] -> {'KEY': 'VALUE'}"""
+    env = {}
+    for pair in pairs or ():
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise ValueError(f"--server-env expects KEY=VALUE, got {pair!r}")
+        env[key] = value
+    return env
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """live_price_server.py in a child process, fed by the synthetic provider"""
+
+    def __init__(self, port, env=None, seed=None):
+        self.port = port
+        self.env = dict(os.environ)
+        # Nothing external or left over: no database, no interest publisher, no network prices, no snapshot
+        for key in ('QUOTE_FEED_DSN', 'INTEREST_DSN', 'HISTORY_DSN'):
+            self.env.pop(key, None)
+        self.env.update({
+            'LIVE_PRICE_PORT': str(port),
+            'WARM_START_PATH': '',
+            'PRICE_PROVIDERS': 'synthetic',
+            'PRICE_PROVIDER_OVERRIDES': '',
+            'LOG_LEVEL': 'WARNING',
+        })
+        if seed is not None:
+            self.env['SYNTHETIC_SEED'] = str(seed)
+        self.env.update(env or {})
+        self.process = None
+
+    def start(self, timeout=30.0):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'live_price_server.py')
+        self.process = subprocess.Popen([sys.executable, script], env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"live_price_server.py exited with code {self.process.returncode}")
+            try:
+                conn = http.client.HTTPConnection('localhost', self.port, timeout=1)
+                conn.request('GET', '/health')
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+                conn.close()
+            except OSError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"live_price_server.py did not answer /health within {timeout}s")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class Client(threading.Thread):
+    """Sends requests back to back until stop_at, recording (endpoint, seconds, error kind or None, started)"""
+
+    def __init__(self, host, port, mix, stop_at, timeout, seed):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.stop_at = stop_at
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.samples = []
+
+    def run(self):
+        while True:
+            started = time.perf_counter()
+            if started >= self.stop_at:
+                return
+            name = self.rng.choices(self.names, self.weights)[0]
+            error = None
+            try:
+                # The server speaks HTTP/1.0, so every request gets its own connection
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                try:
+                    conn.request('GET', ENDPOINTS[name](self.rng))
+                    response = conn.getresponse()
+                    response.read()
+                    if not 200 <= response.status < 300:
+                        error = f'http_{response.status}'
+                finally:
+                    conn.close()
+            except Exception as e:
+                error = type(e).__name__
+            self.samples.append((name, time.perf_counter() - started, error, started))
+
+
+def run_load(host, port, mix, concurrency, duration, warmup, timeout, seed):
+    """Drive the server; samples that started during the warmup are left out of the results"""
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    clients = [Client(host, port, mix, stop_at, timeout, seed + i) for i in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    by_endpoint = {}
+    errors = {}
+    for client in clients:
+        for name, seconds, error, started in client.samples:
+            if started < measure_from:
+                continue
+            entry = by_endpoint.setdefault(name, {'latencies': [], 'errors': 0})
+            entry['latencies'].append(seconds)
+            if error is not None:
+                entry['errors'] += 1
+                errors[error] = errors.get(error, 0) + 1
+
+    def report(latencies, error_count):
+        stats = summarize(latencies)
+        stats['throughput_rps'] = len(latencies) / duration
+        stats['error_rate'] = error_count / len(latencies) if latencies else 0.0
+        return stats
+
+    endpoints = {name: report(entry['latencies'], entry['errors']) for name, entry in sorted(by_endpoint.items())}
+    overall = report([seconds for entry in by_endpoint.values() for seconds in entry['latencies']],
+                     sum(entry['errors'] for entry in by_endpoint.values()))
+    return {'overall': overall, 'endpoints': endpoints, 'errors': errors}
+
+
+def print_report(results):
+    config = results['config']
+    print(f"\n📊 {results['label']}: {config['concurrency']} clients, {config['duration']}s")
+    print(f"   {'endpoint':<12}{'requests':>10}{'req/s':>10}{'errors':>9}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(results['endpoints'].items()) + [('overall', results['overall'])]
+    for name, stats in rows:
+        if not stats['count']:
+            print(f"   {name:<12}{0:>10}")
+            continue
+        print(f"   {name:<12}{stats['count']:>10}{stats['throughput_rps']:>10.1f}{stats['error_rate']:>9.2%}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+    if results['errors']:
+        print(f"   errors by kind: {results['errors']}")
+
+
+def print_comparison(results, baseline):
+    print(f"\n🔍 {results['label']} vs {baseline.get('label', 'baseline')}")
+    print(f"   {'endpoint':<12}{'req/s':>20}{'p99 ms':>22}")
+    names = list(results['endpoints']) + ['overall']
+    for name in names:
+        current = results['overall'] if name == 'overall' else results['endpoints'][name]
+        before = baseline.get('overall') if name == 'overall' else baseline.get('endpoints', {}).get(name)
+        if not before or not before.get('count') or not current.get('count'):
+            continue
+        print(f"   {name:<12}{before['throughput_rps']:>9.1f} -> {current['throughput_rps']:<8.1f}"
+              f"{before['p99_ms']:>10.2f} -> {current['p99_ms']:<8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test live_price_server.py')
+    parser.add_argument('--url', help='Target a running server instead of starting one, e.g. http://localhost:8888')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to measure')
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds of load before measuring starts')
+    parser.add_argument('--mix', default='prices=2,symbol=6,health=2',
+                        help=f'Weighted request mix over {",".join(ENDPOINTS)}')
+    parser.add_argument('--timeout', type=float, default=5, help='Per-request timeout in seconds')
+    parser.add_argument('--server-env', action='append', metavar='KEY=VALUE',
+                        help='Environment for the started server, e.g. DEMAND_POLLING=0 (repeatable)')
+    parser.add_argument('--label', help='Name for this run in the report (default: the server env)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the mix and the synthetic feed')
+    parser.add_argument('--output', default='load_results.json', help='Where to write results')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    server_env = parse_env(args.server_env)
+    label = args.label or (' '.join(f'{k}={v}' for k, v in sorted(server_env.items())) or 'default')
+
+    server = None
+    if args.url:
+        target = urlparse(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        host, port = 'localhost', free_port()
+        server = ServerProcess(port, server_env, seed=args.seed)
+        print(f"🚀 Starting live_price_server.py on port {port} with the synthetic price source...")
+        server.start()
+
+    try:
+        print(f"🔥 {args.concurrency} clients for {args.warmup}s warmup + {args.duration}s...")
+        measured = run_load(host, port, mix, args.concurrency, args.duration, args.warmup, args.timeout, args.seed)
+    finally:
+        if server is not None:
+            server.stop()
+
+    results = {
+        'created_at': datetime.utcnow().isoformat(),
+        'label': label,
+        'config': {
+            'target': args.url or 'local',
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'mix': dict(mix),
+            'server_env': server_env,
+        },
+        **measured,
+    }
+    print_report(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Minimal Prometheus-style metrics for the market data services
+Counters, gauges and histograms rendered in the text exposition format
+"""
+
+import json
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if registry is not None:
+            registry.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} requires labels {self.labelnames}")
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _ValueChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+        self._function = None
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def render(self, name, labelnames, key):
+        try:
+            value = self.get()
+        except Exception:
+            # A failing set_function callback costs its own sample, not the whole scrape
+            value = float('nan')
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(value)}"]
+
+
+class _GaugeChild(_ValueChild):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function):
+        """Read the value from function() at scrape time, e.g. a queue's qsize"""
+        self._function = function
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self, name, labelnames, key):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self._buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(labelnames, key, ('le', _format_value(bound)))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key, ('le', '+Inf'))
+        lines.append(f"{name}_bucket{labels} {count}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, key)} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+def render(registry=REGISTRY):
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/health' and self.server.health is not None:
+            try:
+                healthy, details = self.server.health()
+            except Exception as e:
+                healthy, details = False, {'error': str(e)}
+            body = json.dumps({'status': 'ok' if healthy else 'unhealthy', **details}).encode('utf-8')
+            self.send_response(200 if healthy else 503)
+            self.send_header('Content-Type', 'application/json')
+        elif path == '/metrics':
+            body = render()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='', health=None):
+    """
+    Serve /metrics from a daemon thread and return the server
+
+    health, if given, backs /health: it returns (healthy, details dict) and is
+    answered with 200 or 503. Since this thread keeps serving when the caller's
+    own loop is stuck, health should check that loop's progress.
+    """
+    httpd = HTTPServer((host, port), MetricsHandler)
+    httpd.health = health
+    thread = threading.Thread(target=httpd.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return httpd
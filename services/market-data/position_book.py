@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+In-process position book with vectorized P&L revaluation
+Open positions are held as NumPy arrays grouped by symbol; each tick is a few
+array operations, and only positions whose P&L moved are written back in batches
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from account_book import AccountBook
+
+POSITION_WRITE_THRESHOLD = float(os.getenv('POSITION_WRITE_THRESHOLD', '0.01'))
+POSITION_FLUSH_SECONDS = float(os.getenv('POSITION_FLUSH_SECONDS', '2'))
+POSITION_SYNC_SECONDS = float(os.getenv('POSITION_SYNC_SECONDS', '5'))
+
+# Accounts are held in USD; other instruments are priced in these currencies
+CURRENCIES = ('USD', 'EUR', 'GBP', 'JPY', 'AUD', 'CAD', 'CHF', 'NZD')
+INDEX_CURRENCIES = {'FTSE100': 'GBP', 'DAX': 'EUR', 'NIKKEI': 'JPY'}
+
+logger = logging.getLogger(__name__)
+
+# Floating P&L comes from the book, which holds every open position
+ACCOUNT_UPDATE_SQL = """
+    UPDATE trading_accounts ta
+    SET equity = round(ta.balance + v.floating::numeric, 2),
+        margin = round(v.margin::numeric, 2),
+        free_margin = round(ta.balance + v.floating::numeric - v.margin::numeric, 2),
+        margin_level = CASE WHEN v.margin > 0
+            THEN round((ta.balance + v.floating::numeric) / v.margin::numeric * 100, 2) ELSE 0 END,
+        updated_at = now()
+    FROM (VALUES %s) AS v(id, margin, floating)
+    WHERE ta.id = v.id::uuid
+"""
+
+# Sharded workers each revalue only their own symbols, and only the positions table
+# has every account's P&L in one place, so the floating P&L is summed there. That
+# costs a pass over the account's positions per written account, once per flush.
+SHARED_ACCOUNT_UPDATE_SQL = """
+    UPDATE trading_accounts ta
+    SET equity = round(ta.balance + f.floating, 2),
+        margin = round(v.margin::numeric, 2),
+        free_margin = round(ta.balance + f.floating - v.margin::numeric, 2),
+        margin_level = CASE WHEN v.margin > 0
+            THEN round((ta.balance + f.floating) / v.margin::numeric * 100, 2) ELSE 0 END,
+        updated_at = now()
+    FROM (VALUES %s) AS v(id, margin, floating)
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(sum(p.profit), 0) AS floating
+        FROM positions p
+        WHERE p.trading_account_id = v.id::uuid
+    ) f
+    WHERE ta.id = v.id::uuid
+"""
+
+
+def quote_currency(symbol):
+    """Currency a symbol's price is quoted in: the second half of a currency pair, else USD unless listed"""
+    if len(symbol) == 6 and symbol[3:] in CURRENCIES:
+        return symbol[3:]
+    return INDEX_CURRENCIES.get(symbol, 'USD')
+
+
+class SymbolBook:
+    """
+    Columnar view of the open positions on one symbol
+
+    notional is the position value in USD: the size itself for a USD-base pair,
+    otherwise size times open price, converted at usd_rate (USD per unit of the
+    quote currency).
+    """
+
+    COLUMNS = ('account_idx', 'side', 'volume', 'open_price', 'stop_loss', 'take_profit', 'current_price',
+               'profit', 'written_profit', 'swap', 'notional', 'margin', 'alive', 'dirty')
+
+    def __init__(self, symbol, contract_size, rows, account_idx, usd_rate=1.0):
+        self.symbol = symbol
+        self.contract_size = float(contract_size)
+        self.ids = [row[0] for row in rows]
+        self.index = {pos_id: i for i, pos_id in enumerate(self.ids)}
+        self.account_ids = [row[1] for row in rows]
+        self.account_idx = np.asarray(account_idx, dtype=np.intp)
+
+        def column(i, default=np.nan):
+            return np.array([float(row[i]) if row[i] else default for row in rows], dtype=np.float64)
+
+        self.side = np.array([1.0 if row[2] == 'BUY' else -1.0 for row in rows], dtype=np.float64)
+        self.volume = column(3, 0.0)
+        self.open_price = column(4, 0.0)
+        self.stop_loss = column(5)
+        self.take_profit = column(6)
+        self.current_price = column(7)
+        self.profit = column(8, 0.0)
+        self.written_profit = self.profit.copy()
+        self.swap = np.where(self.side > 0, 1.0, -1.0) * 0.000001 * self.volume * self.open_price
+        if symbol[:3] == 'USD' and quote_currency(symbol) != 'USD':
+            self.notional = self.volume * self.contract_size
+        else:
+            self.notional = self.volume * self.contract_size * self.open_price * usd_rate
+        self.margin = np.zeros(len(rows), dtype=np.float64)
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.dirty = np.zeros(len(rows), dtype=bool)
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def extend(self, other):
+        """Append another book's positions on the same symbol; returns self"""
+        offset = len(self.ids)
+        for name in self.COLUMNS:
+            setattr(self, name, np.concatenate([getattr(self, name), getattr(other, name)]))
+        self.ids.extend(other.ids)
+        self.account_ids.extend(other.account_ids)
+        self.index.update((pos_id, offset + i) for i, pos_id in enumerate(other.ids))
+        return self
+
+    def compact(self):
+        """Drop closed positions' rows; row indexes change"""
+        keep = np.flatnonzero(self.alive)
+        for name in self.COLUMNS:
+            setattr(self, name, getattr(self, name)[keep])
+        self.ids = [self.ids[i] for i in keep]
+        self.account_ids = [self.account_ids[i] for i in keep]
+        self.index = {pos_id: i for i, pos_id in enumerate(self.ids)}
+
+    def matches(self, i, row):
+        """Whether a positions row still describes row i; a changed volume or open price needs a reload"""
+        side = 1.0 if row[2] == 'BUY' else -1.0
+        return (self.side[i] == side and self.volume[i] == float(row[3] or 0)
+                and self.open_price[i] == float(row[4] or 0))
+
+    def set_marks(self, i, current_price, profit):
+        """Take P&L written by another worker; returns the change"""
+        profit = float(profit or 0)
+        delta = profit - self.profit[i]
+        self.current_price[i] = float(current_price) if current_price else np.nan
+        self.profit[i] = self.written_profit[i] = profit
+        return delta
+
+    def set_orders(self, i, stop_loss, take_profit):
+        self.stop_loss[i] = float(stop_loss) if stop_loss else np.nan
+        self.take_profit[i] = float(take_profit) if take_profit else np.nan
+
+    def revalue(self, bid, ask, threshold):
+        """Mark to market; returns the per-position P&L change (zero for closed positions)"""
+        # BUY positions are marked at the bid, SELL positions at the ask
+        self.current_price = np.where(self.side > 0, bid, ask)
+        profit = self.side * (self.current_price - self.open_price) * self.volume * self.contract_size
+        deltas = np.where(self.alive, profit - self.profit, 0.0)
+        self.profit = profit
+        self.dirty |= np.abs(self.profit - self.written_profit) > threshold
+        return deltas
+
+    def triggered(self):
+        """(position_id, close_price) for alive positions whose SL or TP was hit"""
+        buy = self.side > 0
+        price = self.current_price
+        with np.errstate(invalid='ignore'):
+            sl_hit = np.where(buy, price <= self.stop_loss, price >= self.stop_loss) & self.alive
+            tp_hit = np.where(buy, price >= self.take_profit, price <= self.take_profit) & self.alive & ~sl_hit
+        hits = []
+        for i in np.flatnonzero(sl_hit):
+            hits.append((self.ids[i], float(self.stop_loss[i])))
+        for i in np.flatnonzero(tp_hit):
+            hits.append((self.ids[i], float(self.take_profit[i])))
+        return hits
+
+    def remove(self, pos_id):
+        """Drop a position; returns its row index, or None if it was not open here"""
+        i = self.index.get(pos_id)
+        if i is None or not self.alive[i]:
+            return None
+        self.alive[i] = False
+        self.dirty[i] = False
+        return i
+
+    def dirty_rows(self):
+        """Indexes and (id, current_price, profit, swap) rows that need writing back"""
+        rows_idx = np.flatnonzero(self.dirty & self.alive)
+        rows = [(self.ids[i], float(self.current_price[i]), float(self.profit[i]), float(self.swap[i]))
+                for i in rows_idx]
+        return rows_idx, rows
+
+    def mark_written(self, rows_idx, profits):
+        self.written_profit[rows_idx] = profits
+        self.dirty[rows_idx] = False
+
+
+class PositionBook:
+    """
+    Open positions by symbol, kept in sync with the positions table
+
+    POSITION_WRITE_THRESHOLD  P&L change that marks a position for write-back (default 0.01)
+    POSITION_FLUSH_SECONDS    how often dirty positions are written in one batch (default 2)
+    POSITION_SYNC_SECONDS     how often positions opened, closed or modified elsewhere are picked up (default 5)
+
+    usd_rate(currency) gives USD per unit of a currency; margin of positions
+    priced in another currency is converted with it when they are loaded.
+
+    Equity, used margin and margin level of the owning accounts are kept in
+    self.accounts and written back in the same flush. Written equity is the
+    table's balance plus the floating P&L held here; with shared_accounts
+    (sharded workers) it is summed from the positions table instead, so workers
+    sharing an account agree on it.
+    """
+
+    def __init__(self, contract_size, write_threshold=POSITION_WRITE_THRESHOLD,
+                 flush_interval=POSITION_FLUSH_SECONDS, sync_interval=POSITION_SYNC_SECONDS, accounts=None,
+                 usd_rate=lambda currency: 1.0, shared_accounts=False):
+        self.contract_size = contract_size
+        self.shared_accounts = shared_accounts
+        self.usd_rate = usd_rate
+        self.write_threshold = write_threshold
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.books = {}
+        self.accounts = accounts if accounts is not None else AccountBook()
+        self.account_positions = {}
+        self.pending_checks = set()
+        self.last_flush = 0.0
+        self.last_sync = 0.0
+
+    def __len__(self):
+        return sum(len(book) for book in self.books.values())
+
+    def symbols(self):
+        """Symbols that currently have open positions"""
+        return [symbol for symbol, book in self.books.items() if book.alive.any()]
+
+    def sync(self, conn, owned=None):
+        """
+        Apply positions opened, closed or modified elsewhere; pending P&L is flushed first
+
+        Positions already in the book keep their P&L and write-back state. Only
+        new and removed positions move their accounts' floating P&L and margin, so
+        a sync doesn't re-sum or rewrite accounts that didn't change. With owned
+        given, positions on other symbols take their P&L from the table, where
+        the workers owning those symbols write it.
+        """
+        written = self.flush(conn)
+        # Accounts still holding positions here are fetched even with none left in the
+        # table, so an account emptied elsewhere picks up its booked balance.
+        # One statement, so balances and positions come from the same snapshot.
+        held = [self.accounts.ids[account] for account, positions in self.account_positions.items()
+                if any(book.alive[i] for book, i in positions)]
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT p.id, ta.id, p.type, p.volume, p.open_price, p.stop_loss,
+                   p.take_profit, p.current_price, p.profit, p.symbol, ta.balance, ta.leverage
+            FROM trading_accounts ta
+            LEFT JOIN positions p ON p.trading_account_id = ta.id
+            WHERE p.id IS NOT NULL OR ta.id = ANY(%s::uuid[])
+        """, (held,))
+        by_symbol = {}
+        accounts = {}
+        for row in cursor.fetchall():
+            if row[0] is not None:
+                by_symbol.setdefault(row[9], []).append(row)
+            accounts.setdefault(row[1], (row[1], row[10], row[11]))
+        cursor.close()
+        conn.commit()
+
+        releveraged = self.accounts.load(list(accounts.values()))
+        seen = set()
+        added = removed = 0
+        marked_idx, marked_deltas = [], []
+        for symbol, rows in by_symbol.items():
+            book = self.books.get(symbol)
+            foreign = owned is not None and symbol not in owned
+            new_rows = []
+            for row in rows:
+                seen.add(row[0])
+                i = book.index.get(row[0]) if book is not None else None
+                if i is not None and book.alive[i] and book.matches(i, row):
+                    book.set_orders(i, row[5], row[6])
+                    if foreign:
+                        marked_idx.append(book.account_idx[i])
+                        marked_deltas.append(book.set_marks(i, row[7], row[8]))
+                    continue
+                if i is not None and book.alive[i]:
+                    self.remove(symbol, row[0])
+                    removed += 1
+                new_rows.append(row)
+            if new_rows:
+                fresh = SymbolBook(symbol, self.contract_size(symbol), new_rows,
+                                   [self.accounts.index[row[1]] for row in new_rows],
+                                   self.usd_rate(quote_currency(symbol)))
+                fresh.margin = self.accounts.position_margin(fresh.account_idx, fresh.notional)
+                self.accounts.add_positions(fresh.account_idx, fresh.profit, fresh.notional)
+                self.books[symbol] = fresh if book is None else book.extend(fresh)
+                added += len(new_rows)
+
+        if marked_idx:
+            self.pending_checks.update(self.accounts.apply_deltas(
+                np.array(marked_idx, dtype=np.intp), np.array(marked_deltas, dtype=np.float64)).tolist())
+
+        for symbol, book in self.books.items():
+            for i in np.flatnonzero(book.alive):
+                if book.ids[i] not in seen:
+                    self.remove(symbol, book.ids[i])
+                    removed += 1
+
+        if added or removed:
+            for book in self.books.values():
+                if len(book) * 2 < len(book.ids):
+                    book.compact()
+            self.books = {symbol: book for symbol, book in self.books.items() if len(book.ids)}
+            self.account_positions = {}
+            for book in self.books.values():
+                for i, account in enumerate(book.account_idx):
+                    self.account_positions.setdefault(int(account), []).append((book, i))
+
+        for account in releveraged.tolist():
+            positions = [(book, i) for book, i in self.account_positions.get(account, ()) if book.alive[i]]
+            for book, i in positions:
+                book.margin[i] = self.accounts.position_margin(book.account_idx[i], book.notional[i])
+            self.accounts.set_margin(account, sum(book.margin[i] for book, i in positions))
+
+        self.last_sync = time.monotonic()
+        logger.debug("Position book synced", extra={'positions': len(self), 'added': added, 'removed': removed})
+        return written
+
+    def flush(self, conn):
+        """Write back every position and account whose P&L moved past the threshold, in one transaction"""
+        rows = []
+        written = []
+        for book in self.books.values():
+            rows_idx, book_rows = book.dirty_rows()
+            if book_rows:
+                rows.extend(book_rows)
+                written.append((book, rows_idx, book.profit[rows_idx]))
+        account_idx, equity, account_rows = self.accounts.dirty_rows()
+        self.last_flush = time.monotonic()
+        if not rows and not account_rows:
+            return 0
+
+        cursor = conn.cursor()
+        if rows:
+            execute_values(cursor, """
+                UPDATE positions p
+                SET current_price = v.current_price,
+                    profit = v.profit,
+                    swap = v.swap
+                FROM (VALUES %s) AS v(id, current_price, profit, swap)
+                WHERE p.id = v.id::uuid
+            """, rows, page_size=1000)
+        if account_rows:
+            sql = SHARED_ACCOUNT_UPDATE_SQL if self.shared_accounts else ACCOUNT_UPDATE_SQL
+            execute_values(cursor, sql, account_rows, page_size=1000)
+        conn.commit()
+        cursor.close()
+
+        # Only marked clean once committed, so a failed batch is retried on the next flush
+        for book, rows_idx, profits in written:
+            book.mark_written(rows_idx, profits)
+        self.accounts.mark_written(account_idx, equity)
+        return len(rows)
+
+    def maintain(self, conn, owned=None):
+        """Run whichever of sync and flush is due; returns the rows written back"""
+        now = time.monotonic()
+        if now - self.last_sync >= self.sync_interval:
+            return self.sync(conn, owned)
+        if now - self.last_flush >= self.flush_interval:
+            return self.flush(conn)
+        return 0
+
+    def revalue(self, symbol, bid, ask):
+        book = self.books.get(symbol)
+        if book is not None:
+            deltas = book.revalue(bid, ask, self.write_threshold)
+            self.pending_checks.update(self.accounts.apply_deltas(book.account_idx, deltas).tolist())
+
+    def triggered(self, symbol):
+        book = self.books.get(symbol)
+        return book.triggered() if book is not None else []
+
+    def remove(self, symbol, pos_id, realized_pnl=None):
+        """Drop a closed position; realized_pnl moves into the account balance when the close was booked"""
+        book = self.books.get(symbol)
+        i = book.remove(pos_id) if book is not None else None
+        if i is not None:
+            self.accounts.apply_close(book.account_idx[i], book.profit[i], book.margin[i], realized_pnl)
+
+    def stop_outs(self, symbols=None):
+        """
+        (symbol, position_id, close_price) to close for accounts revalued at or below
+        the stop-out level, largest loss first, until the margin level recovers
+
+        With symbols given, only positions on those symbols are closed; in sharded
+        mode each worker closes its own and the rest follow on their owners' ticks.
+        """
+        touched = np.fromiter(self.pending_checks, dtype=np.intp, count=len(self.pending_checks))
+        self.pending_checks = set()
+        closes = []
+        for account in self.accounts.check_levels(touched):
+            equity = float(self.accounts.equity(account))
+            margin = float(self.accounts.margin[account])
+            open_positions = sorted(
+                ((book, i) for book, i in self.account_positions.get(int(account), ())
+                 if book.alive[i] and not np.isnan(book.current_price[i])
+                 and (symbols is None or book.symbol in symbols)),
+                key=lambda position: position[0].profit[position[1]])
+            closing = []
+            for book, i in open_positions:
+                closing.append((book.symbol, book.ids[i], float(book.current_price[i])))
+                margin -= book.margin[i]
+                if margin <= 0 or equity / margin * 100.0 > self.accounts.stop_out_level:
+                    break
+            if not closing:
+                # All on other workers' symbols (or not priced yet); their owners close them
+                continue
+            logger.warning("Stop out", extra={
+                'trading_account_id': self.accounts.ids[account],
+                'margin_level': round(float(self.accounts.margin_level(account)), 2),
+                'positions': len(closing),
+            })
+            closes.extend(closing)
+        return closes
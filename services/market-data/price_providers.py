@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Pluggable upstream price sources
+Every entry point asks a ProviderChain for a quote; the chain tries each
+symbol's providers in order and fails over past any that are degraded
+"""
+
+import logging
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import yfinance as yf
+
+from bar_buffer import BarRing
+from circuit_breaker import CircuitBreakerRegistry, UPSTREAM_TIMEOUT, call_with_timeout
+
+PRICE_PROVIDERS = os.getenv('PRICE_PROVIDERS', 'yfinance')
+PRICE_PROVIDER_OVERRIDES = os.getenv('PRICE_PROVIDER_OVERRIDES', '')
+PRICE_FILE_DIR = os.getenv('PRICE_FILE_DIR', 'prices')
+SYNTHETIC_VOLATILITY = float(os.getenv('SYNTHETIC_VOLATILITY', '0.0002'))
+SYNTHETIC_SEED = os.getenv('SYNTHETIC_SEED')
+YFINANCE_MAX_BAR_AGE = float(os.getenv('YFINANCE_MAX_BAR_AGE', '900'))
+
+logger = logging.getLogger(__name__)
+
+
+def make_quote(price, bar_high, bar_low, bar_volume, day_high, day_low, day_volume, source, timestamp=None):
+    """
+    The shape every provider returns: the latest price, the latest bar's range and
+    volume, and the range and volume over the trading day (None where unknown)
+    """
+    return {
+        'price': float(price),
+        'bar_high': bar_high,
+        'bar_low': bar_low,
+        'bar_volume': bar_volume,
+        'day_high': day_high,
+        'day_low': day_low,
+        'day_volume': day_volume,
+        'timestamp': timestamp or datetime.utcnow(),
+        'source': source,
+    }
+
+
+def _known(value):
+    """value as a float, or None where the upstream left it missing (NaN)"""
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def quote_from_bars(bars, source):
+    """Quote from an OHLCV frame with yfinance's column names, or None if no bar has a close"""
+    if bars is None or bars.empty:
+        return None
+    bars = bars.dropna(subset=['Close'])
+    if bars.empty:
+        return None
+    latest = bars.iloc[-1]
+    volume = bars['Volume'].fillna(0) if 'Volume' in bars.columns else None
+    return make_quote(
+        latest['Close'],
+        _known(latest['High']),
+        _known(latest['Low']),
+        int(volume.iloc[-1]) if volume is not None else 0,
+        _known(bars['High'].max()),
+        _known(bars['Low'].min()),
+        int(volume.sum()) if volume is not None else 0,
+        source,
+    )
+
+
+def quote_from_ring(ring, source):
+    """Quote from the newest bar and the running day aggregates of a BarRing"""
+    latest = ring.latest()
+    if latest is None:
+        return None
+    _, _, high, low, close, volume = latest
+    return make_quote(close, _known(high), _known(low), int(volume), _known(ring.day_high), _known(ring.day_low),
+                      int(ring.day_volume), source)
+
+
+class PriceProvider:
+    """Base class; quote(symbol) returns a make_quote dict, None when there is no data, or raises"""
+
+    name = None
+
+    def supports(self, symbol):
+        return True
+
+    def quote(self, symbol):
+        raise NotImplementedError
+
+
+class YFinanceProvider(PriceProvider):
+    """
+    Minute bars from Yahoo Finance, falling back to 5 minute bars and then ticker.info
+
+    Minute bars are kept in a BarRing per symbol; after the first full day, each
+    call only downloads bars from the newest one held (which may still be forming).
+
+    YFINANCE_MAX_BAR_AGE  an incremental download that comes back empty while the
+                          newest bar held is older than this (seconds) fails
+                          instead of repeating that bar (default 900)
+    """
+
+    name = 'yfinance'
+
+    def __init__(self, ticker_map, timeout=UPSTREAM_TIMEOUT):
+        self.ticker_map = ticker_map
+        self.timeout = timeout
+        self.rings = {}
+
+    def supports(self, symbol):
+        return symbol in self.ticker_map
+
+    def quote(self, symbol):
+        ticker = yf.Ticker(self.ticker_map[symbol])
+        ring = self.rings.get(symbol)
+        if ring is None:
+            ring = self.rings[symbol] = BarRing()
+
+        if len(ring) and time.time() - ring.last_ts > 86400:
+            # Long gaps (idle symbols, weekends) start over; Yahoo only serves 1m bars a few weeks back
+            ring.clear()
+        if len(ring):
+            start = datetime.fromtimestamp(ring.last_ts, tz=timezone.utc)
+            bars = ticker.history(start=start, interval='1m', timeout=self.timeout)
+            if (bars is None or bars.empty) and time.time() - ring.last_ts > YFINANCE_MAX_BAR_AGE:
+                # A dead or delisted symbol; failing lets the breaker trip and the chain fall back
+                return None
+            ring.extend_frame(bars)
+        else:
+            ring.extend_frame(ticker.history(period='1d', interval='1m', timeout=self.timeout))
+        quote = quote_from_ring(ring, 'yfinance_real')
+        if quote is not None:
+            return quote
+
+        bars = ticker.history(period='5d', interval='5m', timeout=self.timeout)
+        quote = quote_from_bars(bars, 'yfinance_real')
+        if quote is not None:
+            return quote
+
+        info = call_with_timeout(lambda: ticker.info, self.timeout, key=f'{self.name}:{symbol}')
+        if 'bid' in info and 'ask' in info:
+            price, source = (float(info['bid']) + float(info['ask'])) / 2, 'yfinance_info'
+        elif 'currentPrice' in info:
+            price, source = info['currentPrice'], 'yfinance_info'
+        elif 'regularMarketPrice' in info:
+            price, source = info['regularMarketPrice'], 'yfinance_market_price'
+        else:
+            return None
+        volume = int(info.get('volume') or 0)
+        return make_quote(price, None, None, 0, None, None, volume, source)
+
+
+class FileProvider(PriceProvider):
+    """
+    Replays minute bars from <directory>/<SYMBOL>.csv or .parquet, one bar per call
+
+    Files need open, high, low, close and (optionally) timestamp and volume
+    columns, in any case. Replayed bars are stamped with the current minute and
+    fed through a BarRing, so the day range behaves as it does live. Playback
+    wraps at the end of the file, and a file is reloaded when its mtime changes.
+    """
+
+    name = 'file'
+
+    def __init__(self, directory=PRICE_FILE_DIR):
+        self.directory = directory
+        self.frames = {}
+        self.cursors = {}
+        self.rings = {}
+        self._lock = threading.Lock()
+
+    def path(self, symbol):
+        for extension in ('.parquet', '.csv'):
+            path = os.path.join(self.directory, symbol + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def supports(self, symbol):
+        return self.path(symbol) is not None
+
+    def load(self, symbol):
+        path = self.path(symbol)
+        if path is None:
+            return None
+        mtime = os.path.getmtime(path)
+        cached = self.frames.get(symbol)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        frame = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+        frame.columns = [str(column).strip().capitalize() for column in frame.columns]
+        if 'Timestamp' in frame.columns:
+            frame = frame.sort_values('Timestamp').reset_index(drop=True)
+        if 'Volume' not in frame.columns:
+            frame['Volume'] = 0.0
+        # Plain arrays so each replayed bar is a few index lookups, not a pandas row
+        frame = {column: frame[column].to_numpy(dtype='float64') for column in ('Open', 'High', 'Low', 'Close', 'Volume')}
+        self.frames[symbol] = (mtime, frame)
+        self.cursors.setdefault(symbol, 0)
+        logger.info("Loaded price file", extra={'symbol': symbol, 'path': path, 'bars': len(frame['Close'])})
+        return frame
+
+    def quote(self, symbol):
+        with self._lock:
+            frame = self.load(symbol)
+            if frame is None or not len(frame['Close']):
+                return None
+            cursor = self.cursors[symbol] % len(frame['Close'])
+            self.cursors[symbol] = cursor + 1
+            ring = self.rings.get(symbol)
+            if ring is None:
+                ring = self.rings[symbol] = BarRing()
+            ring.extend([int(time.time() // 60) * 60], *([frame[column][cursor]] for column in
+                                                          ('Open', 'High', 'Low', 'Close', 'Volume')))
+            return quote_from_ring(ring, 'file')
+
+
+class SyntheticProvider(PriceProvider):
+    """
+    Gaussian random walk, one step per call, for load tests without any network
+
+    SYNTHETIC_VOLATILITY  standard deviation of each relative step (default 0.0002)
+    SYNTHETIC_SEED        seed for reproducible runs
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, base_prices=None, volatility=SYNTHETIC_VOLATILITY, seed=SYNTHETIC_SEED):
+        self.base_prices = base_prices or {}
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.state = {}
+        self._lock = threading.Lock()
+
+    def quote(self, symbol):
+        now = time.time()
+        minute = int(now // 60)
+        day = int(now // 86400)
+        with self._lock:
+            state = self.state.get(symbol)
+            if state is None:
+                price = float(self.base_prices.get(symbol, 100.0))
+                state = self.state[symbol] = {
+                    'price': price, 'minute': minute, 'day': day,
+                    'bar_high': price, 'bar_low': price, 'bar_volume': 0,
+                    'day_high': price, 'day_low': price, 'day_volume': 0,
+                }
+            price = state['price'] * math.exp(self.random.gauss(0, self.volatility))
+            volume = self.random.randint(0, 50)
+            if state['day'] != day:
+                state.update(day=day, day_high=price, day_low=price, day_volume=0)
+            if state['minute'] != minute:
+                state.update(minute=minute, bar_high=price, bar_low=price, bar_volume=0)
+            state['price'] = price
+            state['bar_high'] = max(state['bar_high'], price)
+            state['bar_low'] = min(state['bar_low'], price)
+            state['bar_volume'] += volume
+            state['day_high'] = max(state['day_high'], price)
+            state['day_low'] = min(state['day_low'], price)
+            state['day_volume'] += volume
+            return make_quote(price, state['bar_high'], state['bar_low'], state['bar_volume'],
+                              state['day_high'], state['day_low'], state['day_volume'], 'synthetic')
+
+
+def parse_overrides(spec):
+    """'BTCUSD=synthetic;GOLD=file,yfinance' -> {'BTCUSD': ['synthetic'], 'GOLD': ['file', 'yfinance']}"""
+    overrides = {}
+    for entry in spec.split(';'):
+        if '=' not in entry:
+            continue
+        symbol, names = entry.split('=', 1)
+        overrides[symbol.strip().upper()] = [name.strip() for name in names.split(',') if name.strip()]
+    return overrides
+
+
+class ProviderChain:
+    """
+    Per-symbol failover across providers
+
+    PRICE_PROVIDERS           default order, comma separated (default yfinance)
+    PRICE_PROVIDER_OVERRIDES  per-symbol order, e.g. BTCUSD=synthetic;GOLD=file,yfinance
+    PRICE_FILE_DIR            directory for the file provider (default prices)
+
+    Each provider has its own breaker per symbol, keyed provider:symbol in the
+    registry, so a degraded source is skipped in favour of the next one until
+    its breaker lets a probe through.
+
+    With a CrossRateEngine (see cross_rates.py), every quote for a major is fed
+    to it, and cross quotes from either source are compared with the other.
+    """
+
+    def __init__(self, providers, order=None, overrides=None, breakers=None, cross_rates=None):
+        self.providers = {provider.name: provider for provider in providers}
+        order = order if order is not None else [name.strip() for name in PRICE_PROVIDERS.split(',') if name.strip()]
+        overrides = overrides if overrides is not None else parse_overrides(PRICE_PROVIDER_OVERRIDES)
+        for name in order + [name for names in overrides.values() for name in names]:
+            if name not in self.providers:
+                raise ValueError(f"unknown price provider {name!r}; available: {sorted(self.providers)}")
+        self.order = order
+        self.overrides = overrides
+        self.breakers = breakers or CircuitBreakerRegistry()
+        self.cross_rates = cross_rates
+
+    @classmethod
+    def from_env(cls, ticker_map, base_prices=None, breakers=None):
+        """
+        The standard providers, ordered by PRICE_PROVIDERS and PRICE_PROVIDER_OVERRIDES
+
+        Crosses set to the derived source (CROSS_RATE_SOURCE / CROSS_RATE_OVERRIDES) try
+        the derived provider first, unless PRICE_PROVIDER_OVERRIDES names them.
+        """
+        # cross_rates builds on this module
+        from cross_rates import CrossRateEngine, DerivedProvider
+
+        engine = CrossRateEngine(list(ticker_map))
+        order = [name.strip() for name in PRICE_PROVIDERS.split(',') if name.strip()]
+        overrides = parse_overrides(PRICE_PROVIDER_OVERRIDES)
+        for cross in engine.derived_symbols():
+            overrides.setdefault(cross, ['derived'] + order)
+        return cls([
+            YFinanceProvider(ticker_map),
+            FileProvider(),
+            SyntheticProvider(base_prices),
+            DerivedProvider(engine),
+        ], order=order, overrides=overrides, breakers=breakers, cross_rates=engine)
+
+    def providers_for(self, symbol):
+        names = self.overrides.get(symbol, self.order)
+        return [self.providers[name] for name in names if self.providers[name].supports(symbol)]
+
+    def state_value(self, symbol):
+        """Breaker state of the healthiest provider for symbol: 0 while any source is usable"""
+        states = [self.breakers.state_value(f"{provider.name}:{symbol}") for provider in self.providers_for(symbol)]
+        return min(states) if states else 0
+
+    def quote(self, symbol):
+        """First quote any provider returns, tagged with its provider; None if all had no data; raises the last error"""
+        quote = self.first_quote(symbol, self.providers_for(symbol))
+        if quote is not None and self.cross_rates is not None:
+            self.cross_rates.observe(symbol, quote)
+            if symbol in self.cross_rates.legs:
+                self.compare_cross(symbol, quote)
+        return quote
+
+    def fetch_order(self, symbols):
+        """symbols with every cross moved after the majors it is derived from"""
+        if self.cross_rates is None:
+            return list(symbols)
+        crosses = self.cross_rates.legs
+        return [symbol for symbol in symbols if symbol not in crosses] + [symbol for symbol in symbols if symbol in crosses]
+
+    def compare_cross(self, symbol, quote):
+        """Feed the divergence monitor: a derived quote is checked against a direct fetch now and then"""
+        engine = self.cross_rates
+        if quote['provider'] == 'derived':
+            if not engine.check_due(symbol):
+                return
+            try:
+                direct = self.first_quote(symbol, [provider for provider in self.providers_for(symbol)
+                                                   if provider.name != 'derived'])
+            except Exception as e:
+                logger.warning("Direct cross rate check failed", extra={'symbol': symbol, 'error': str(e)})
+                return
+            if direct is not None:
+                engine.record_divergence(symbol, quote['price'], direct['price'])
+        else:
+            # Deriving is free whenever the legs are fresh
+            derived = engine.derive(symbol)
+            if derived is not None:
+                engine.record_divergence(symbol, derived['price'], quote['price'])
+
+    def first_quote(self, symbol, providers):
+        error = None
+        for provider in providers:
+            key = f"{provider.name}:{symbol}"
+            if not self.breakers.allow(key):
+                continue
+            try:
+                quote = provider.quote(symbol)
+            except Exception as e:
+                self.breakers.record_failure(key, e)
+                error = e
+                continue
+            if quote is None:
+                self.breakers.record_failure(key, 'empty data')
+                continue
+            self.breakers.record_success(key)
+            quote['provider'] = provider.name
+            return quote
+        if error is not None:
+            raise error
+        return None
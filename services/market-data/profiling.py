@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Opt-in profiling for the market data cycle
+Records a per-stage breakdown of every cycle and dumps slow cycles, with the
+hottest stack frames, to a local JSON file
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+
+PROFILE_MODES = ('off', 'cprofile', 'sample')
+
+logger = logging.getLogger(__name__)
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'symbol', 'start')
+
+    def __init__(self, profiler, name, symbol):
+        self.profiler = profiler
+        self.name = name
+        self.symbol = symbol
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record_stage(self.name, time.perf_counter() - self.start, self.symbol)
+        return False
+
+
+class CycleProfiler:
+    """
+    Per-cycle profiler for MarketDataService.run
+
+    PROFILE_MODE=off       stage timings only; stacks are sampled once a cycle
+                           has run for half of SLOW_CYCLE_SECONDS
+    PROFILE_MODE=cprofile  cProfile every cycle (SIGUSR1 toggles this at runtime)
+    PROFILE_MODE=sample    sample the main thread stack for the whole cycle
+    """
+
+    def __init__(self, mode=None, slow_cycle_seconds=None, output_dir=None, sample_interval=None):
+        mode = (mode or os.getenv('PROFILE_MODE', 'off')).lower()
+        if mode not in PROFILE_MODES:
+            logger.warning("Unknown PROFILE_MODE, profiling disabled", extra={'mode': mode})
+            mode = 'off'
+        self.mode = mode
+        self.slow_cycle_seconds = float(
+            slow_cycle_seconds if slow_cycle_seconds is not None else os.getenv('SLOW_CYCLE_SECONDS', '10'))
+        self.output_dir = output_dir or os.getenv('PROFILE_DIR', 'profiles')
+        self.sample_interval = float(
+            sample_interval if sample_interval is not None else os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01'))
+
+        self.cycle = 0
+        self.stages = {}
+        self.symbol_times = {}
+        self._cycle_start = None
+        self._profile = None
+        self._mode_changed = False
+        self._samples = Counter()
+        self._sample_count = 0
+        self._samples_lock = threading.Lock()
+
+        self._main_thread_id = threading.main_thread().ident
+        self._cycle_started = threading.Event()
+        self._cycle_done = threading.Event()
+        self._cycle_done.set()
+        self._watchdog = None
+        if self.slow_cycle_seconds > 0 or self.mode == 'sample':
+            self._watchdog = threading.Thread(target=self._watch, name='cycle-profiler', daemon=True)
+            self._watchdog.start()
+
+    def install_signal_handler(self, signum=getattr(signal, 'SIGUSR1', None)):
+        """Toggle cProfile on the next cycle when signum is received"""
+        if signum is None:
+            return
+        signal.signal(signum, self._toggle_cprofile)
+
+    def _toggle_cprofile(self, signum, frame):
+        # Logged from begin_cycle; logging inside a signal handler can deadlock on the queue lock
+        self.mode = 'off' if self.mode == 'cprofile' else 'cprofile'
+        self._mode_changed = True
+
+    def stage(self, name, symbol=None):
+        return _Stage(self, name, symbol)
+
+    def record_stage(self, name, seconds, symbol=None):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if symbol is not None:
+            self.symbol_times[symbol] = self.symbol_times.get(symbol, 0.0) + seconds
+
+    def begin_cycle(self, cycle):
+        if self._mode_changed:
+            self._mode_changed = False
+            logger.info("Profiling mode switched", extra={'mode': self.mode})
+        self.cycle = cycle
+        self.stages = {}
+        self.symbol_times = {}
+        with self._samples_lock:
+            self._samples = Counter()
+            self._sample_count = 0
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._cycle_start = time.perf_counter()
+        self._cycle_done.clear()
+        self._cycle_started.set()
+
+    def end_cycle(self):
+        """Finish the cycle; returns the dump path if the cycle was slow"""
+        if self._cycle_start is None:
+            return None
+        duration = time.perf_counter() - self._cycle_start
+        self._cycle_done.set()
+        self._cycle_start = None
+
+        profile = self._profile
+        self._profile = None
+        if profile is not None:
+            profile.disable()
+
+        if self.slow_cycle_seconds > 0 and duration >= self.slow_cycle_seconds:
+            return self.dump(duration, profile)
+        return None
+
+    def dump(self, duration, profile=None):
+        with self._samples_lock:
+            sample_count = self._sample_count
+            top_stacks = self._samples.most_common(10)
+
+        report = {
+            'cycle': self.cycle,
+            'duration_seconds': round(duration, 4),
+            'threshold_seconds': self.slow_cycle_seconds,
+            'captured_at': datetime.utcnow().isoformat(),
+            'mode': self.mode,
+            'stages': {name: round(seconds, 4) for name, seconds in
+                       sorted(self.stages.items(), key=lambda item: -item[1])},
+            'slowest_symbols': [[symbol, round(seconds, 4)] for symbol, seconds in
+                                sorted(self.symbol_times.items(), key=lambda item: -item[1])[:10]],
+            'stack_samples': sample_count,
+            'top_stacks': [{'samples': count, 'frames': list(frames)} for frames, count in top_stacks],
+        }
+        if profile is not None:
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(30)
+            report['cprofile'] = stream.getvalue()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(
+            self.output_dir, f"slow_cycle_{self.cycle}_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.warning("Slow cycle captured", extra={
+            'cycle': self.cycle, 'duration_s': round(duration, 3), 'path': path
+        })
+        return path
+
+    def _watch(self):
+        while True:
+            self._cycle_started.wait()
+            self._cycle_started.clear()
+            delay = 0 if self.mode == 'sample' else self.slow_cycle_seconds / 2
+            if self._cycle_done.wait(delay):
+                continue
+            self._sample_until_done()
+
+    def _sample_until_done(self):
+        while not self._cycle_done.is_set():
+            frame = sys._current_frames().get(self._main_thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame)[-12:]
+                key = tuple(f"{os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in stack)
+                with self._samples_lock:
+                    self._samples[key] += 1
+                    self._sample_count += 1
+            del frame
+            self._cycle_done.wait(self.sample_interval)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Compact binary encoding for quote snapshots
+A fixed header followed by the records as columns of LEB128 varints: symbol
+IDs from a stable table (delta coded), quote age against the header's epoch-ns
+snapshot time, and prices in fixed point at each symbol's precision, with ask,
+high and low stored as small offsets from bid
+"""
+
+import struct
+import time
+
+import numpy as np
+
+from quote_record import QuoteSnapshot
+
+CONTENT_TYPE = 'application/x-quote-records'
+MAGIC = b'QR'
+VERSION = 2
+
+# Append only: IDs are positions in this table (starting at 1) and clients cache them.
+# The second field is the number of decimals prices are scaled by.
+SYMBOL_TABLE = (
+    ('EURUSD', 5), ('GBPUSD', 5), ('USDJPY', 3), ('AUDUSD', 5), ('USDCAD', 5),
+    ('USDCHF', 5), ('NZDUSD', 5), ('EURGBP', 5), ('EURJPY', 3), ('GBPJPY', 3),
+    ('AUDJPY', 3), ('GBPAUD', 5), ('EURCAD', 5), ('EURAUD', 5),
+    ('GOLD', 2), ('SILVER', 3), ('OIL', 3), ('COPPER', 4), ('NATURALGAS', 4),
+    ('SPX500', 2), ('NASDAQ', 2), ('DJI', 2), ('FTSE100', 2), ('DAX', 2), ('NIKKEI', 2),
+    ('BTCUSD', 2), ('ETHUSD', 2), ('BNBUSD', 2), ('XRPUSD', 5), ('ADAUSD', 5), ('SOLUSD', 2),
+)
+
+SYMBOL_IDS = {symbol: i + 1 for i, (symbol, _) in enumerate(SYMBOL_TABLE)}
+SCALES = {symbol: 10 ** decimals for symbol, decimals in SYMBOL_TABLE}
+
+# magic, version, flags, record count, snapshot time (epoch ns)
+HEADER = struct.Struct('<2sBBHq')
+# The body holds count varints per column, one column after another. Signed columns are zigzag coded.
+COLUMNS = ('id_delta', 'age_us', 'bid', 'ask_offset', 'high_offset', 'low_offset', 'volume')
+SIGNED = (False, True, True, True, True, True, False)
+
+_SIGNED_ROWS = np.flatnonzero(SIGNED)
+# 7 bits per varint byte: a value needs one byte more for each threshold it reaches
+_SHIFTS = np.arange(0, 64, 7, dtype=np.uint64)
+_THRESHOLDS = np.uint64(1) << _SHIFTS[1:]
+_SYMBOLS_BY_ID = [None] + [symbol for symbol, _ in SYMBOL_TABLE]
+_SCALES_BY_ID = np.array([1.0] + [10.0 ** decimals for _, decimals in SYMBOL_TABLE])
+
+
+def symbol_table():
+    """The table as clients fetch it from /api/symbols"""
+    return [{'id': SYMBOL_IDS[symbol], 'symbol': symbol, 'decimals': decimals}
+            for symbol, decimals in SYMBOL_TABLE]
+
+
+def zigzag(values):
+    """int64 -> uint64 with small magnitudes of either sign staying small"""
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def encode_varints(values):
+    """uint64 array -> LEB128 bytes, all values at once"""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.searchsorted(_THRESHOLDS, values, side='right') + 1
+    width = int(lengths.max(initial=1))
+    positions = np.arange(width)
+    groups = (values[:, None] >> _SHIFTS[:width]) & np.uint64(0x7f)
+    groups[positions < (lengths - 1)[:, None]] |= np.uint64(0x80)
+    return groups[positions < lengths[:, None]].astype(np.uint8).tobytes()
+
+
+def decode_varints(data, count):
+    """First count LEB128 values in data -> (uint64 array, bytes consumed)"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError("truncated quote snapshot")
+    if not count:
+        return np.empty(0, dtype=np.uint64), 0
+    used = int(ends[-1]) + 1
+    starts = np.empty(count, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    position = np.arange(used) - np.repeat(starts, ends - starts + 1)
+    parts = (raw[:used] & 0x7f).astype(np.uint64) << (position.astype(np.uint64) * np.uint64(7))
+    return np.add.reduceat(parts, starts), used
+
+
+def encode_snapshot(quotes, now=None):
+    """
+    quotes: a QuoteSnapshot, or an iterable of (symbol, Quote); now: epoch seconds.
+    Symbols missing from SYMBOL_TABLE, and records with a NaN or infinite price
+    or timestamp, are left out; records are in ID order.
+    """
+    snapshot = quotes if isinstance(quotes, QuoteSnapshot) else QuoteSnapshot.from_quotes(quotes)
+    ids = np.fromiter((SYMBOL_IDS.get(symbol, 0) for symbol in snapshot.symbols), dtype=np.int64, count=len(snapshot))
+    finite = np.isfinite(np.stack((snapshot.bid, snapshot.ask, snapshot.high, snapshot.low, snapshot.ts))).all(axis=0)
+    ids[~finite] = 0
+    order = np.argsort(ids, kind='stable')[np.count_nonzero(ids == 0):]
+    ids = ids[order]
+
+    now_ns = time.time_ns() if now is None else round(now * 1e9)
+    # np.rint rounds half to even, as round() does
+    prices = np.stack((snapshot.bid, snapshot.ask, snapshot.high, snapshot.low))[:, order]
+    bid, ask, high, low = np.rint(prices * _SCALES_BY_ID[ids]).astype(np.int64)
+
+    columns = np.empty((len(COLUMNS), len(ids)), dtype=np.int64)
+    columns[0, :1] = ids[:1]
+    columns[0, 1:] = ids[1:] - ids[:-1]
+    columns[1] = np.rint((now_ns - snapshot.ts[order] * 1e9) / 1e3)
+    columns[2] = bid
+    columns[3] = ask - bid
+    columns[4] = high - bid
+    columns[5] = bid - low
+    columns[6] = np.maximum(np.nan_to_num(snapshot.volume[order], posinf=0.0), 0)
+    body = columns.view(np.uint64)
+    body[_SIGNED_ROWS] = zigzag(columns[_SIGNED_ROWS])
+    return HEADER.pack(MAGIC, VERSION, 0, len(ids), now_ns) + encode_varints(body.ravel())
+
+
+def decode_snapshot(payload):
+    """Inverse of encode_snapshot: (snapshot_ns, {symbol: quote with a timestamp_ns field})"""
+    magic, version, _, count, snapshot_ns = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not a version {VERSION} quote snapshot")
+    values, _ = decode_varints(payload[HEADER.size:], count * len(COLUMNS))
+    matrix = values.reshape(len(COLUMNS), count)
+    ids = np.cumsum(matrix[0]).astype(np.intp)
+    age_us, bid, ask_offset, high_offset, low_offset = unzigzag(matrix[_SIGNED_ROWS])
+    prices = np.stack((bid, bid + ask_offset, bid + high_offset, bid - low_offset)) / _SCALES_BY_ID[ids]
+    bids, asks, highs, lows = prices.tolist()
+    rows = zip(ids.tolist(), bids, asks, highs, lows, matrix[6].astype(np.int64).tolist(),
+               (snapshot_ns - age_us * 1000).tolist())
+    quotes = {
+        _SYMBOLS_BY_ID[symbol_id]: {'bid': b, 'ask': a, 'high': h, 'low': l, 'volume': v, 'timestamp_ns': t}
+        for symbol_id, b, a, h, l, v, t in rows
+    }
+    return snapshot_ns, quotes
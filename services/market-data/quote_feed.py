@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Postgres LISTEN/NOTIFY quote fan-out
+MarketDataService publishes one compact payload per written tick; QuoteSubscriber
+keeps a local quote cache current from the channel
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+
+from quote_record import Quote
+
+QUOTE_CHANNEL = os.getenv('QUOTE_CHANNEL', 'quotes')
+# Unchanged quotes are only re-published on the heartbeat, so a quiet symbol is still current
+QUOTE_FEED_MAX_AGE = float(os.getenv('QUOTE_FEED_MAX_AGE', os.getenv('QUOTE_HEARTBEAT_SECONDS', '60')))
+
+logger = logging.getLogger(__name__)
+
+
+def encode_quote(symbol, quote):
+    """Compact JSON payload; well under the 8000 byte NOTIFY limit"""
+    return json.dumps({
+        's': symbol,
+        'b': quote.bid,
+        'a': quote.ask,
+        'h': quote.high,
+        'l': quote.low,
+        'v': quote.volume,
+        't': round(quote.ts, 3),
+    }, separators=(',', ':'))
+
+
+def decode_quote(payload):
+    """Inverse of encode_quote; returns (symbol, Quote)"""
+    data = json.loads(payload)
+    return data['s'], Quote(data['b'], data['a'], data['h'], data['l'], data['v'], data['t'])
+
+
+class QuoteSubscriber:
+    """
+    Keeps self.quotes current from NOTIFY payloads on a background thread
+
+    On (re)connect the cache is seeded from the latest market_data row per
+    symbol, so nothing published while disconnected is missed for long.
+    """
+
+    def __init__(self, dsn, channel=QUOTE_CHANNEL, on_update=None, reconnect_delay=1.0, max_reconnect_delay=30.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.on_update = on_update
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.quotes = {}
+        self.received_at = {}
+        self.connected = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Build a subscriber from QUOTE_FEED_DSN, or return None if it is unset"""
+        dsn = os.getenv('QUOTE_FEED_DSN')
+        if not dsn:
+            return None
+        return cls(dsn, **kwargs)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='quote-subscriber', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def get(self, symbol, max_age=None):
+        """Latest pushed quote for symbol, or None if missing or older than max_age seconds"""
+        quote = self.quotes.get(symbol)
+        if quote is None:
+            return None
+        if max_age is not None and time.time() - self.received_at.get(symbol, 0) > max_age:
+            return None
+        return quote
+
+    def snapshot(self):
+        return dict(self.quotes)
+
+    def _store(self, symbol, quote, received_at=None):
+        self.quotes[symbol] = quote
+        self.received_at[symbol] = received_at if received_at is not None else time.time()
+        if self.on_update:
+            self.on_update(symbol, quote)
+
+    def _seed(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT ON (symbol) symbol, bid, ask, high, low, volume, timestamp
+            FROM market_data
+            ORDER BY symbol, timestamp DESC
+        """)
+        for symbol, bid, ask, high, low, volume, timestamp in cursor.fetchall():
+            # Seeded rows are as old as their timestamp, not as old as this query
+            self._store(symbol, Quote(float(bid), float(ask), float(high), float(low), int(volume),
+                                      timestamp.timestamp()), received_at=timestamp.timestamp())
+        cursor.close()
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                cursor.close()
+                self._seed(conn)
+                self.connected = True
+                delay = self.reconnect_delay
+                logger.info("Quote subscriber listening", extra={'channel': self.channel})
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self._store(*decode_quote(notify.payload))
+                        except (ValueError, KeyError) as e:
+                            logger.warning("Bad quote payload", extra={'error': str(e)})
+            except Exception as e:
+                self.connected = False
+                logger.warning("Quote subscriber disconnected", extra={'error': str(e), 'retry_in_s': delay})
+                self._stop.wait(delay)
+                delay = min(self.max_reconnect_delay, delay * 2)
+            finally:
+                if conn is not None:
+                    conn.close()
+        self.connected = False
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Compact quote records for the caches and serializers
+One slotted object per quote, with a float epoch timestamp instead of a dict
+holding a datetime, and a columnar snapshot for serving many symbols at once
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(timestamp):
+    """Naive UTC datetime -> float seconds since the epoch"""
+    return (timestamp - _EPOCH).total_seconds()
+
+
+def utc_datetime(ts):
+    """Float seconds since the epoch -> naive UTC datetime"""
+    return _EPOCH + timedelta(seconds=ts)
+
+
+class Quote:
+    """
+    bid, ask, high, low, volume and ts (float epoch seconds, UTC)
+
+    Records are treated as immutable once cached; restamped() returns a copy.
+    The ISO form of ts is built on first use and kept, so a cached quote served
+    to many clients is only formatted once.
+    """
+
+    __slots__ = ('bid', 'ask', 'high', 'low', 'volume', 'ts', '_iso')
+
+    def __init__(self, bid, ask, high, low, volume=0, ts=None):
+        self.bid = bid
+        self.ask = ask
+        self.high = high
+        self.low = low
+        self.volume = volume
+        self.ts = time.time() if ts is None else ts
+        self._iso = None
+
+    def __repr__(self):
+        return (f"Quote(bid={self.bid!r}, ask={self.ask!r}, high={self.high!r}, low={self.low!r}, "
+                f"volume={self.volume!r}, ts={self.ts!r})")
+
+    @property
+    def timestamp(self):
+        """ts as a naive UTC datetime, for the database"""
+        return utc_datetime(self.ts)
+
+    def iso(self):
+        if self._iso is None:
+            self._iso = self.timestamp.isoformat()
+        return self._iso
+
+    def key(self):
+        """What change detection compares: everything but the timestamp"""
+        return (self.bid, self.ask, self.high, self.low, self.volume)
+
+    def restamped(self, ts=None):
+        return Quote(self.bid, self.ask, self.high, self.low, self.volume, ts)
+
+    def row(self, symbol):
+        """(symbol, bid, ask, high, low, volume, timestamp) as market_data stores it"""
+        return (symbol, self.bid, self.ask, self.high, self.low, self.volume, self.timestamp)
+
+    def to_dict(self, symbol=None):
+        data = {
+            'bid': self.bid,
+            'ask': self.ask,
+            'high': self.high,
+            'low': self.low,
+            'volume': self.volume,
+            'timestamp': self.iso(),
+        }
+        if symbol is not None:
+            data = {'symbol': symbol, **data}
+        return data
+
+
+class QuoteSnapshot:
+    """
+    Quotes for many symbols as parallel NumPy columns
+
+    Built once per request from cached Quote records; the binary codec packs the
+    columns directly and JSON output is produced column by column.
+    """
+
+    __slots__ = ('symbols', 'bid', 'ask', 'high', 'low', 'volume', 'ts', 'iso')
+
+    def __init__(self, symbols, bid, ask, high, low, volume, ts, iso=None):
+        self.symbols = symbols
+        self.bid = bid
+        self.ask = ask
+        self.high = high
+        self.low = low
+        self.volume = volume
+        self.ts = ts
+        self.iso = iso
+
+    @classmethod
+    def from_quotes(cls, items):
+        """items: iterable of (symbol, Quote)"""
+        items = list(items)
+        quotes = [quote for _, quote in items]
+        return cls(
+            [symbol for symbol, _ in items],
+            np.fromiter((q.bid for q in quotes), dtype=np.float64, count=len(quotes)),
+            np.fromiter((q.ask for q in quotes), dtype=np.float64, count=len(quotes)),
+            np.fromiter((q.high for q in quotes), dtype=np.float64, count=len(quotes)),
+            np.fromiter((q.low for q in quotes), dtype=np.float64, count=len(quotes)),
+            np.fromiter((q.volume or 0 for q in quotes), dtype=np.float64, count=len(quotes)),
+            np.fromiter((q.ts for q in quotes), dtype=np.float64, count=len(quotes)),
+            [q.iso() for q in quotes],
+        )
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def to_dicts(self):
+        """{symbol: quote dict} in the JSON API's shape"""
+        iso = self.iso or [utc_datetime(ts).isoformat() for ts in self.ts.tolist()]
+        volumes = [int(volume) for volume in self.volume.tolist()]
+        return {
+            symbol: {'symbol': symbol, 'bid': bid, 'ask': ask, 'high': high, 'low': low,
+                     'volume': volume, 'timestamp': timestamp}
+            for symbol, bid, ask, high, low, volume, timestamp in zip(
+                self.symbols, self.bid.tolist(), self.ask.tolist(), self.high.tolist(),
+                self.low.tolist(), volumes, iso)
+        }
@@ -1,64 +1,266 @@
 #!/usr/bin/env python3
 """
-Script to run the YFinance Market Data Service
+Supervisor for the market data services
+Runs the market data service (or its shard workers) and the live price server,
+streams their output as it is written, restarts them with backoff when they exit
+or fail health checks, and stops them with the signal that lets them flush
 """
 
-import subprocess
-import sys
+import json
+import logging
 import os
 import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
 
-def main():
-    print("🚀 Starting YFinance Market Data Service...")
+from structured_logging import setup_logging
+
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '1'))
+LIVE_PRICE_SERVER = os.getenv('LIVE_PRICE_SERVER', '1') == '1'
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+LIVE_PRICE_PORT = int(os.getenv('LIVE_PRICE_PORT', '8888'))
+HEALTH_INTERVAL = float(os.getenv('HEALTH_INTERVAL', '5'))
+HEALTH_TIMEOUT = float(os.getenv('HEALTH_TIMEOUT', '2'))
+HEALTH_GRACE_SECONDS = float(os.getenv('HEALTH_GRACE_SECONDS', '30'))
+HEALTH_FAILURES = int(os.getenv('HEALTH_FAILURES', '3'))
+RESTART_BASE_BACKOFF = float(os.getenv('RESTART_BASE_BACKOFF', '1'))
+RESTART_MAX_BACKOFF = float(os.getenv('RESTART_MAX_BACKOFF', '60'))
+RESTART_RESET_SECONDS = float(os.getenv('RESTART_RESET_SECONDS', '60'))
+STOP_TIMEOUT = float(os.getenv('STOP_TIMEOUT', '20'))
+
+logger = logging.getLogger('supervisor')
+
+_output_lock = threading.Lock()
+
+
+def python_command(script):
+    """Run through uv when the project virtualenv exists, as before"""
+    venv_dir = '../../.venv'
+    if os.path.exists(venv_dir):
+        return [sys.executable, '-m', 'uv', 'run', '--project', venv_dir, 'python', script]
+    return [sys.executable, script]
+
+
+def write_line(line):
+    with _output_lock:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+class Child:
+    """
+    One supervised process
+
+    The child's stdout and stderr are merged into a pipe drained by a reader
+    thread, so it can never block on a full pipe. JSON log lines are passed
+    through with a `child` field added; anything else (e.g. a traceback) is
+    wrapped into a supervisor log record.
+    """
+
+    def __init__(self, name, command, env=None, health_url=None, stop_signal=signal.SIGTERM, clock=time.monotonic):
+        self.name = name
+        self.command = command
+        self.env = env or {}
+        self.health_url = health_url
+        self.stop_signal = stop_signal
+        self.clock = clock
+        self.process = None
+        self.reader = None
+        self.started_at = None
+        self.last_health_check = 0.0
+        self.health_failures = 0
+        self.restarts = 0
+        self.backoff = RESTART_BASE_BACKOFF
+        self.restart_at = 0.0
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        env = dict(os.environ)
+        env.update(self.env)
+        # A session of its own: a terminal Ctrl-C reaches only the supervisor, which
+        # then stops children in order
+        self.process = subprocess.Popen(self.command, env=env, stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        start_new_session=True)
+        self.started_at = self.clock()
+        self.last_health_check = self.started_at
+        self.health_failures = 0
+        self.reader = threading.Thread(target=self._pump, args=(self.process.stdout,),
+                                       name=f'{self.name}-output', daemon=True)
+        self.reader.start()
+        logger.info("Process started", extra={'child': self.name, 'pid': self.process.pid})
 
+    def _pump(self, stream):
+        for raw in iter(stream.readline, b''):
+            line = raw.decode('utf-8', 'replace').rstrip('\n')
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = None
+            if isinstance(entry, dict):
+                entry.setdefault('child', self.name)
+                write_line(json.dumps(entry, default=str))
+            else:
+                logger.info("Process output", extra={'child': self.name, 'line': line})
+        stream.close()
+
+    def check_health(self):
+        """True unless the health endpoint has failed HEALTH_FAILURES times in a row"""
+        now = self.clock()
+        if (self.health_url is None or now - self.started_at < HEALTH_GRACE_SECONDS
+                or now - self.last_health_check < HEALTH_INTERVAL):
+            return True
+        self.last_health_check = now
+        try:
+            with urllib.request.urlopen(self.health_url, timeout=HEALTH_TIMEOUT) as response:
+                healthy = response.status == 200
+        except Exception as e:
+            healthy = False
+            logger.warning("Health check failed", extra={'child': self.name, 'url': self.health_url,
+                                                         'error': str(e)})
+        self.health_failures = 0 if healthy else self.health_failures + 1
+        return self.health_failures < HEALTH_FAILURES
+
+    def stop(self, timeout=STOP_TIMEOUT, signalled=False):
+        """Send the stop signal (unless already sent), then SIGKILL once timeout has passed"""
+        if not self.running:
+            return
+        if not signalled:
+            self.signal(self.stop_signal)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("Process did not stop in time, killing it", extra={'child': self.name})
+            self.signal(signal.SIGKILL)
+            self.process.wait()
+        self.join_output()
+
+    def signal(self, signum):
+        try:
+            os.kill(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def join_output(self):
+        if self.reader is not None:
+            self.reader.join(5)
+            self.reader = None
+
+    def schedule_restart(self, reason):
+        """Back off before restarting; a child that ran long enough starts from the base delay"""
+        now = self.clock()
+        if now - self.started_at >= RESTART_RESET_SECONDS:
+            self.backoff = RESTART_BASE_BACKOFF
+        self.restart_at = now + self.backoff
+        logger.warning("Process will be restarted", extra={
+            'child': self.name, 'reason': reason, 'exit_code': self.process.returncode,
+            'restart_in': self.backoff, 'restarts': self.restarts,
+        })
+        self.backoff = min(RESTART_MAX_BACKOFF, self.backoff * 2)
+        self.process = None
+
+
+class Supervisor:
+    """
+    Keeps every child running until asked to stop
+
+    SHARD_WORKERS          market data processes; more than 1 runs them with SHARDING=1 (default 1)
+    LIVE_PRICE_SERVER      also run live_price_server.py (default 1)
+    HEALTH_INTERVAL        seconds between health checks per child (default 5)
+    HEALTH_TIMEOUT         seconds a health check may take (default 2)
+    HEALTH_GRACE_SECONDS   no health checks for this long after a start (default 30)
+    HEALTH_FAILURES        consecutive failed checks that restart a child (default 3)
+    RESTART_BASE_BACKOFF   first restart delay, doubled per restart (default 1)
+    RESTART_MAX_BACKOFF    longest restart delay (default 60)
+    RESTART_RESET_SECONDS  uptime after which the delay goes back to the base (default 60)
+    STOP_TIMEOUT           seconds a child gets to flush and exit before SIGKILL (default 20)
+    """
+
+    def __init__(self, children):
+        self.children = children
+        self.stopping = threading.Event()
+
+    def request_stop(self, signum, frame):
+        logger.info("Shutdown signal received, stopping processes", extra={'signal': signum})
+        self.stopping.set()
+
+    def run(self, poll_interval=0.5):
+        for child in self.children:
+            child.start()
+        while not self.stopping.wait(poll_interval):
+            now = time.monotonic()
+            for child in self.children:
+                if child.process is None:
+                    if now >= child.restart_at:
+                        child.restarts += 1
+                        child.start()
+                elif child.process.poll() is not None:
+                    child.join_output()
+                    child.schedule_restart('exited')
+                elif not child.check_health():
+                    child.stop()
+                    child.schedule_restart('unhealthy')
+        self.stop()
+
+    def stop(self):
+        # Signal everything first so the children flush in parallel. A second signal
+        # would interrupt the market data service's own shutdown handler.
+        for child in self.children:
+            if child.running:
+                child.signal(child.stop_signal)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for child in self.children:
+            child.stop(timeout=max(0.0, deadline - time.monotonic()), signalled=True)
+        logger.info("All processes stopped")
+
+
+def build_children():
+    children = []
+    for i in range(SHARD_WORKERS):
+        port = METRICS_PORT + i
+        env = {'METRICS_PORT': str(port)}
+        name = 'market_data'
+        if SHARD_WORKERS > 1:
+            name = f'market_data-{i}'
+            # A stable worker ID lets a restarted worker renew its own leases. Each worker
+            # needs its own spool and warm-start files too, since a process replays only what it wrote
+            env.update({'SHARDING': '1', 'WORKER_ID': f'{socket.gethostname()}:{name}',
+                        'SPOOL_PATH': f'market_data-{i}.spool',
+                        'WARM_START_PATH': f'market_data-{i}.warm.npz'})
+        children.append(Child(name, python_command('market_data_service.py'), env=env,
+                              health_url=f'http://localhost:{port}/health'))
+    if LIVE_PRICE_SERVER:
+        # SIGINT goes through the server's KeyboardInterrupt path, which flushes its logs
+        children.append(Child('live_price', python_command('live_price_server.py'),
+                              env={'LIVE_PRICE_PORT': str(LIVE_PRICE_PORT)},
+                              health_url=f'http://localhost:{LIVE_PRICE_PORT}/health',
+                              stop_signal=signal.SIGINT))
+    return children
+
+
+def main():
     # Change to the script directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(script_dir)
 
-    # Run the Python service using the virtual environment
+    log_handle = setup_logging('supervisor')
+    supervisor = Supervisor(build_children())
+    signal.signal(signal.SIGINT, supervisor.request_stop)
+    signal.signal(signal.SIGTERM, supervisor.request_stop)
     try:
-        venv_dir = '../../.venv'
-        if os.path.exists(venv_dir):
-            process = subprocess.Popen([
-                sys.executable,
-                '-m', 'uv',
-                'run',
-                '--project', venv_dir,
-                'python', 'market_data_service.py'
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        else:
-            # Fallback to direct python
-            process = subprocess.Popen([
-                sys.executable,
-                'market_data_service.py'
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        print(f"✅ Service started with PID: {process.pid}")
-
-        # Keep running and monitor
-        while True:
-            if process.poll() is not None:
-                stdout, stderr = process.communicate()
-                if stdout:
-                    print("Service Output:", stdout.decode())
-                if stderr:
-                    print("Service Error:", stderr.decode())
-                print("Service stopped. Restarting...")
-                process = subprocess.Popen([
-                    sys.executable,
-                    'market_data_service.py'
-                ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            import time
-            time.sleep(5)
-
-    except KeyboardInterrupt:
-        print("\n🛑 Stopping Market Data Service...")
-        if process:
-            process.terminate()
-            process.wait()
-        print("✅ Service stopped")
-        sys.exit(0)
+        supervisor.run()
+    finally:
+        log_handle.stop()
+
 
 if __name__ == '__main__':
     main()
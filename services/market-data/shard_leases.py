@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Symbol ownership for sharded market data workers
+Each worker heartbeats a row in market_data_workers and holds expiring leases in
+market_data_symbol_leases; symbols are rebalanced to an even share of the live
+workers, so a dead worker's symbols are picked up once its leases expire
+"""
+
+import logging
+import math
+import os
+import socket
+import time
+
+LEASE_TTL_SECONDS = float(os.getenv('LEASE_TTL_SECONDS', '15'))
+LEASE_RENEW_SECONDS = float(os.getenv('LEASE_RENEW_SECONDS', '5'))
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id():
+    return os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SymbolLeases:
+    """
+    Claims, renews and releases this worker's share of the symbol universe
+
+    LEASE_TTL_SECONDS    how long a lease outlives its last renewal (default 15)
+    LEASE_RENEW_SECONDS  how often leases are renewed and rebalanced (default 5)
+    WORKER_ID            this worker's identity (default hostname:pid)
+
+    A worker only acts on symbols whose lease it renewed within the TTL, less one
+    renew interval of margin, so it stops before another worker can take over.
+    """
+
+    def __init__(self, symbols, worker_id=None, ttl=LEASE_TTL_SECONDS, renew_interval=LEASE_RENEW_SECONDS,
+                 clock=time.monotonic):
+        self.symbols = list(symbols)
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.clock = clock
+        self.owned = set()
+        self.workers = 1
+        self.valid_until = 0.0
+        self.last_renew = None
+
+    def owned_symbols(self):
+        """Symbols this worker may process now, in universe order"""
+        if self.clock() >= self.valid_until:
+            return []
+        return [symbol for symbol in self.symbols if symbol in self.owned]
+
+    def maintain(self, conn):
+        """Renew and rebalance if due; returns True when ownership changed"""
+        if self.last_renew is not None and self.clock() - self.last_renew < self.renew_interval:
+            return False
+        return self.rebalance(conn)
+
+    def rebalance(self, conn):
+        started = self.clock()
+        before = set(self.owned)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO market_data_workers (worker_id, heartbeat_at)
+                VALUES (%s, now())
+                ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = now()
+            """, (self.worker_id,))
+            cursor.execute("""
+                SELECT worker_id FROM market_data_workers
+                WHERE heartbeat_at > now() - %s * interval '1 second'
+            """, (self.ttl,))
+            self.workers = max(1, len(cursor.fetchall()))
+
+            cursor.execute("""
+                UPDATE market_data_symbol_leases
+                SET expires_at = now() + %s * interval '1 second'
+                WHERE owner = %s AND symbol = ANY(%s)
+                RETURNING symbol
+            """, (self.ttl, self.worker_id, self.symbols))
+            owned = {row[0] for row in cursor.fetchall()}
+
+            share = math.ceil(len(self.symbols) / self.workers)
+            if len(owned) > share:
+                # Hand back the tail so the lowest symbols stay put and others pick up the rest
+                surplus = [symbol for symbol in self.symbols if symbol in owned][share:]
+                cursor.execute("""
+                    DELETE FROM market_data_symbol_leases
+                    WHERE owner = %s AND symbol = ANY(%s)
+                """, (self.worker_id, surplus))
+                owned.difference_update(surplus)
+            elif len(owned) < share:
+                cursor.execute("""
+                    SELECT s.symbol
+                    FROM unnest(%s::text[]) WITH ORDINALITY AS s(symbol, position)
+                    LEFT JOIN market_data_symbol_leases l ON l.symbol = s.symbol
+                    WHERE l.symbol IS NULL OR l.expires_at < now()
+                    ORDER BY s.position
+                    LIMIT %s
+                """, (self.symbols, share - len(owned)))
+                free = [row[0] for row in cursor.fetchall()]
+                if free:
+                    # Conditional upsert: a lease someone else renewed in the meantime is left alone
+                    cursor.execute("""
+                        INSERT INTO market_data_symbol_leases (symbol, owner, expires_at)
+                        SELECT symbol, %s, now() + %s * interval '1 second' FROM unnest(%s::text[]) AS symbol
+                        ON CONFLICT (symbol) DO UPDATE
+                        SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+                        WHERE market_data_symbol_leases.expires_at < now()
+                        RETURNING symbol
+                    """, (self.worker_id, self.ttl, free))
+                    owned.update(row[0] for row in cursor.fetchall())
+
+            cursor.execute("""
+                DELETE FROM market_data_workers
+                WHERE heartbeat_at < now() - %s * interval '1 second'
+            """, (self.ttl * 4,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        self.owned = owned
+        self.last_renew = started
+        self.valid_until = started + self.ttl - self.renew_interval
+        changed = owned != before
+        if changed:
+            logger.info("Symbol ownership changed", extra={
+                'worker_id': self.worker_id, 'workers': self.workers, 'owned': len(owned),
+                'gained': sorted(owned - before), 'lost': sorted(before - owned),
+            })
+        return changed
+
+    def release(self, conn):
+        """Give up every lease and the worker row so the rest rebalance without waiting for expiry"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM market_data_symbol_leases WHERE owner = %s", (self.worker_id,))
+            cursor.execute("DELETE FROM market_data_workers WHERE worker_id = %s", (self.worker_id,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.warning("Error releasing symbol leases", extra={'error': str(e)})
+        finally:
+            cursor.close()
+        self.owned = set()
+        self.valid_until = 0.0
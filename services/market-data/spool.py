@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Local write-ahead spool for market data writes the database could not take
+Rows are appended to a JSON-lines file with batched fsyncs while the database
+is unreachable, then replayed in bounded chunks with idempotent upserts on reconnect
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+SPOOL_PATH = os.getenv('SPOOL_PATH', 'market_data.spool')
+SPOOL_FSYNC_SECONDS = float(os.getenv('SPOOL_FSYNC_SECONDS', '1'))
+SPOOL_FSYNC_BATCH = int(os.getenv('SPOOL_FSYNC_BATCH', '500'))
+SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', str(100 * 1024 * 1024)))
+SPOOL_REPLAY_ROWS = int(os.getenv('SPOOL_REPLAY_ROWS', '50000'))
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the connection is gone: the replay is retried in full later
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Replays are idempotent: a tick rewrites its own row, history never overwrites
+REPLAY_SQL = {
+    'tick': """
+        INSERT INTO market_data (symbol, bid, ask, high, low, volume, timestamp)
+        VALUES %s
+        ON CONFLICT (symbol, timestamp) DO UPDATE SET
+        bid = EXCLUDED.bid,
+        ask = EXCLUDED.ask,
+        high = EXCLUDED.high,
+        low = EXCLUDED.low,
+        volume = EXCLUDED.volume
+    """,
+    'history': """
+        INSERT INTO market_data (symbol, bid, ask, high, low, volume, timestamp)
+        VALUES %s
+        ON CONFLICT (symbol, timestamp) DO NOTHING
+    """,
+}
+
+
+class WriteSpool:
+    """
+    Append-only spool of (kind, row) records
+
+    SPOOL_PATH           spool file (default market_data.spool); replays work on <path>.replay,
+                         and rows the database rejects are moved to <path>.rejected
+    SPOOL_FSYNC_SECONDS  longest a spooled row waits for fsync (default 1)
+    SPOOL_FSYNC_BATCH    rows that force an fsync before the interval is up (default 500)
+    SPOOL_MAX_BYTES      spool size past which new rows are dropped (default 100 MiB; 0 = no limit)
+    SPOOL_REPLAY_ROWS    most rows one replay call reads and commits (default 50000)
+
+    Rows are (symbol, bid, ask, high, low, volume, timestamp) for every kind in REPLAY_SQL.
+    """
+
+    def __init__(self, path=SPOOL_PATH, fsync_interval=SPOOL_FSYNC_SECONDS, fsync_batch=SPOOL_FSYNC_BATCH,
+                 max_bytes=SPOOL_MAX_BYTES, clock=time.monotonic):
+        self.path = path
+        self.replay_path = path + '.replay'
+        # Byte offset of the first row of the replay file not yet committed
+        self.offset_path = self.replay_path + '.offset'
+        self.rejected_path = path + '.rejected'
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.unsynced = 0
+        self.last_fsync = clock()
+        self.dropped = 0
+        self._file = None
+        self._lock = threading.Lock()
+        offset = self._read_offset()
+        self.pending = self._count(self.path) + self._count(self.replay_path, offset)
+        self.size = self._size(self.path) + max(0, self._size(self.replay_path) - offset)
+
+    @staticmethod
+    def _count(path, offset=0):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return sum(1 for _ in f)
+
+    @staticmethod
+    def _size(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        temp = self.offset_path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+        os.replace(temp, self.offset_path)
+
+    def __len__(self):
+        return self.pending
+
+    @staticmethod
+    def _encode(kind, row, **extra):
+        return json.dumps({'k': kind, 'r': [
+            row[0], row[1], row[2], row[3], row[4], row[5], row[6].isoformat()
+        ], **extra}, separators=(',', ':')) + '\n'
+
+    def append(self, kind, rows):
+        """
+        Spool rows of one kind; fsynced once the batch or interval is reached
+
+        Returns False, and drops the rows, once the spool has reached max_bytes.
+        Rows already spooled are kept, so an outage loses its newest ticks, not
+        its oldest.
+        """
+        if kind not in REPLAY_SQL:
+            raise ValueError(f"unknown spool kind {kind!r}")
+        lines = ''.join(self._encode(kind, row) for row in rows)
+        with self._lock:
+            if self.max_bytes and self.size + len(lines) > self.max_bytes:
+                self.dropped += len(rows)
+                return False
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(lines)
+            self.unsynced += len(rows)
+            self.pending += len(rows)
+            self.size += len(lines)
+            if self.unsynced >= self.fsync_batch or self.clock() - self.last_fsync >= self.fsync_interval:
+                self._sync()
+        return True
+
+    def sync(self):
+        """Force buffered rows to disk, e.g. at shutdown"""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._file is not None and self.unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.unsynced = 0
+        self.last_fsync = self.clock()
+
+    def replay(self, conn, page_size=1000, max_rows=SPOOL_REPLAY_ROWS):
+        """
+        Write up to max_rows spooled rows to the database; returns the rows replayed
+
+        The live spool is first renamed to <path>.replay so new rows keep landing in
+        a fresh file. The replay file is read and committed max_rows lines at a
+        time, and the offset reached is saved after each commit, so memory and
+        time per call stay bounded. A lost connection part way leaves the
+        uncommitted chunk to be retried. A row the database rejects, and a line
+        that can't be parsed, are moved to <path>.rejected instead, so they don't
+        hold back the rows after them.
+        """
+        # A replay file left by an earlier call goes first, then the live spool
+        with self._lock:
+            if not os.path.exists(self.replay_path) and os.path.exists(self.path):
+                if self._file is not None:
+                    self._sync()
+                    self._file.close()
+                    self._file = None
+                os.replace(self.path, self.replay_path)
+        if not os.path.exists(self.replay_path):
+            return 0
+        return self._replay_chunk(conn, page_size, max_rows)
+
+    def _replay_chunk(self, conn, page_size, max_rows):
+        batches = {kind: {} for kind in REPLAY_SQL}
+        rejected = []
+        offset = self._read_offset()
+        lines = 0
+        with open(self.replay_path, 'rb') as f:
+            f.seek(offset)
+            while lines < max_rows:
+                line = f.readline().decode('utf-8', errors='replace')
+                if not line:
+                    break
+                lines += 1
+                try:
+                    record = json.loads(line)
+                    row = record['r']
+                    row[6] = datetime.fromisoformat(row[6])
+                    # Keyed on the conflict target: one upsert can't touch a row twice
+                    batches[record['k']][(row[0], row[6])] = tuple(row)
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    # Usually a torn final line from a crash mid-write
+                    if line.strip():
+                        rejected.append(json.dumps({'line': line.rstrip('\n'), 'e': str(e)}) + '\n')
+            end = f.tell()
+            finished = not f.read(1)
+
+        replayed = 0
+        cursor = conn.cursor()
+        try:
+            for kind, rows in batches.items():
+                if rows:
+                    replayed += self._write(cursor, kind, list(rows.values()), page_size, rejected)
+            # Rejected rows are kept before the commit; a retry after a crash here only repeats them
+            if rejected:
+                with open(self.rejected_path, 'a', encoding='utf-8') as f:
+                    f.writelines(rejected)
+                    f.flush()
+                    os.fsync(f.fileno())
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        # A crash before the offset is saved only repeats this chunk's idempotent upserts
+        with self._lock:
+            if finished:
+                os.remove(self.replay_path)
+                if os.path.exists(self.offset_path):
+                    os.remove(self.offset_path)
+            else:
+                self._write_offset(end)
+            self.pending = max(0, self.pending - lines)
+            self.size = max(0, self.size - (end - offset))
+        if rejected:
+            logger.warning("Spooled rows rejected", extra={'rows': len(rejected), 'path': self.rejected_path})
+        logger.info("Replayed spooled writes", extra={'rows': replayed, 'rejected': len(rejected), 'left': self.pending})
+        return replayed
+
+    def _write(self, cursor, kind, rows, page_size, rejected):
+        """
+        Upsert rows under a savepoint; when the database rejects the batch, halve it
+        until the offending rows are isolated, and add those to rejected
+        """
+        cursor.execute("SAVEPOINT spool_replay")
+        try:
+            execute_values(cursor, REPLAY_SQL[kind], rows, page_size=page_size)
+        except CONNECTION_ERRORS:
+            raise
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT spool_replay")
+            if len(rows) == 1:
+                rejected.append(self._encode(kind, rows[0], e=str(e).strip()))
+                return 0
+            middle = len(rows) // 2
+            return (self._write(cursor, kind, rows[:middle], page_size, rejected)
+                    + self._write(cursor, kind, rows[middle:], page_size, rejected))
+        cursor.execute("RELEASE SAVEPOINT spool_replay")
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Non-blocking structured (JSON) logging for the market data services
+Records are handed to a bounded queue and written by a background thread, so
+a slow or blocked stdout never stalls the tick loop
+"""
+
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+QUIET_LOGGERS = ('yfinance', 'urllib3', 'peewee')
+
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; extra={...} fields become top-level keys"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'service': self.service,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only resolve the message here; JSON encoding happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records below WARNING; warnings and errors always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class LoggingHandle:
+    """What setup_logging hands back: the queue, the handler and the listener thread"""
+
+    def __init__(self, log_queue, handler, listener):
+        self.queue = log_queue
+        self.handler = handler
+        self.listener = listener
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def dropped(self):
+        return self.handler.dropped
+
+    def stop(self, timeout=5.0):
+        """Flush queued records and stop the writer thread, waiting at most timeout"""
+        listener, self.listener = self.listener, None
+        if listener is None:
+            return
+        try:
+            self.queue.put(listener._sentinel, timeout=timeout)
+        except queue.Full:
+            return
+        listener._thread.join(timeout)
+
+
+def setup_logging(service, stream=None):
+    """
+    Route all logging through a queue; '<service>.tick' gets its own level and sampling
+
+    LOG_LEVEL             level for everything else (default INFO)
+    TICK_LOG_LEVEL        level for per-tick messages (default WARNING)
+    TICK_LOG_SAMPLE_RATE  fraction of per-tick records below WARNING to keep (default 0.1)
+    LOG_QUEUE_SIZE        records buffered before new ones are dropped (default 10000)
+    """
+    log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    handler = NonBlockingQueueHandler(log_queue)
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JSONFormatter(service))
+    listener = QueueListener(log_queue, writer, respect_handler_level=False)
+    listener.start()
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for noisy in QUIET_LOGGERS:
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    tick_logger = logging.getLogger(f'{service}.tick')
+    tick_logger.setLevel(os.getenv('TICK_LOG_LEVEL', 'WARNING').upper())
+    tick_logger.filters = [SamplingFilter(float(os.getenv('TICK_LOG_SAMPLE_RATE', '0.1')))]
+
+    return LoggingHandle(log_queue, handler, listener)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Demand-driven symbol subscriptions
+A symbol is active while it has open positions or recent client interest;
+active symbols are polled at full rate and idle ones only get a slow
+background refresh
+"""
+
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+
+SUBSCRIPTION_IDLE_SECONDS = float(os.getenv('SUBSCRIPTION_IDLE_SECONDS', '120'))
+IDLE_REFRESH_SECONDS = float(os.getenv('IDLE_REFRESH_SECONDS', '60'))
+INTEREST_SYNC_SECONDS = float(os.getenv('INTEREST_SYNC_SECONDS', '5'))
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionRegistry:
+    """
+    An interest timestamp per symbol, plus the symbols with open positions
+
+    SUBSCRIPTION_IDLE_SECONDS  how long a symbol stays active after its last interest (default 120)
+    IDLE_REFRESH_SECONDS       refresh interval for idle symbols (default 60)
+    INTEREST_SYNC_SECONDS      how often interest is published to / loaded from the database (default 5)
+    """
+
+    def __init__(self, idle_timeout=SUBSCRIPTION_IDLE_SECONDS, idle_refresh=IDLE_REFRESH_SECONDS, clock=time.monotonic):
+        self.idle_timeout = idle_timeout
+        self.idle_refresh = idle_refresh
+        self.clock = clock
+        self.last_interest = {}
+        self.position_symbols = frozenset()
+        self.unpublished = set()
+        self._lock = threading.Lock()
+
+    def touch(self, symbol):
+        """Record client interest, e.g. an API request for symbol"""
+        with self._lock:
+            self.last_interest[symbol] = self.clock()
+            self.unpublished.add(symbol)
+
+    def set_position_symbols(self, symbols):
+        self.position_symbols = frozenset(symbols)
+
+    def merge_interest(self, ages):
+        """Interest recorded elsewhere (see load_interest), as {symbol: seconds since last seen}"""
+        now = self.clock()
+        with self._lock:
+            for symbol, age in ages.items():
+                self.last_interest[symbol] = max(self.last_interest.get(symbol, 0.0), now - age)
+
+    def interest_ages(self):
+        """{symbol: seconds since last interest} for interest within the idle timeout, for merge_interest"""
+        now = self.clock()
+        with self._lock:
+            return {symbol: now - last for symbol, last in self.last_interest.items()
+                    if now - last < self.idle_timeout}
+
+    def is_active(self, symbol):
+        if symbol in self.position_symbols:
+            return True
+        last = self.last_interest.get(symbol)
+        return last is not None and self.clock() - last < self.idle_timeout
+
+    def due(self, symbol, age):
+        """Whether a symbol last refreshed age seconds ago (None if never) should be refreshed now"""
+        if age is None or self.is_active(symbol):
+            return True
+        return age >= self.idle_refresh
+
+    def active_symbols(self, universe):
+        return [symbol for symbol in universe if self.is_active(symbol)]
+
+    def publish_interest(self, conn):
+        """Upsert interest recorded since the last call into market_data_interest"""
+        with self._lock:
+            symbols, self.unpublished = sorted(self.unpublished), set()
+        if not symbols:
+            return 0
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO market_data_interest (symbol, last_seen_at)
+                SELECT symbol, now() FROM unnest(%s::text[]) AS symbol
+                ON CONFLICT (symbol) DO UPDATE SET last_seen_at = EXCLUDED.last_seen_at
+            """, (symbols,))
+            conn.commit()
+        except Exception:
+            with self._lock:
+                self.unpublished.update(symbols)
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return len(symbols)
+
+    def load_interest(self, conn):
+        """Merge interest other processes published within the idle timeout"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT symbol, extract(epoch FROM now() - last_seen_at)
+                FROM market_data_interest
+                WHERE last_seen_at > now() - %s * interval '1 second'
+            """, (self.idle_timeout,))
+            ages = {symbol: max(0.0, float(age)) for symbol, age in cursor.fetchall()}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.merge_interest(ages)
+        return list(ages)
+
+    def start_publisher(self, dsn, interval=INTEREST_SYNC_SECONDS):
+        """Publish interest from a daemon thread with its own connection"""
+        thread = threading.Thread(target=self._publish_loop, args=(dsn, interval),
+                                  name='interest-publisher', daemon=True)
+        thread.start()
+        return thread
+
+    def _publish_loop(self, dsn, interval):
+        conn = None
+        while True:
+            time.sleep(interval)
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(dsn)
+                self.publish_interest(conn)
+            except Exception as e:
+                logger.warning("Error publishing symbol interest", extra={'error': str(e)})
+                if conn is not None:
+                    conn.close()
+                conn = None
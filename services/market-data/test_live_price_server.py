@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from quote_record import Quote
+from warm_start import WarmStart
+
+
+class SlowProvider:
+    """Stands in for the provider chain; every quote waits until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def quote(self, symbol):
+        self.calls.append(symbol)
+        self.release.wait(10)
+        return {'price': 1.2, 'day_high': None, 'day_low': None, 'day_volume': 0}
+
+
+@pytest.fixture
+def restored_service(tmp_path, monkeypatch):
+    for key in ('QUOTE_FEED_DSN', 'INTEREST_DSN', 'HISTORY_DSN'):
+        monkeypatch.delenv(key, raising=False)
+    path = str(tmp_path / 'live_price.warm.npz')
+    monkeypatch.setenv('WARM_START_PATH', path)
+    written = time.time() - 60
+    WarmStart(path).save({'EURUSD': Quote(1.1, 1.1002, 1.11, 1.09, 10, written)}, {'EURUSD': written})
+
+    from live_price_server import YFinancePriceService
+    service = YFinancePriceService()
+    service.prices = SlowProvider()
+    yield service
+    service.prices.release.set()
+
+
+def test_first_response_after_restore_does_not_wait_on_the_provider(restored_service):
+    started = time.monotonic()
+    quote = restored_service.get_price('EURUSD')
+    assert time.monotonic() - started < 0.5
+    assert quote.bid == 1.1
+
+    # The background refresh replaces it once the provider answers
+    restored_service.prices.release.set()
+    deadline = time.monotonic() + 5
+    while 'EURUSD' in restored_service.restored and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert restored_service.prices.calls == ['EURUSD']
+    assert restored_service.get_price('EURUSD').bid != 1.1
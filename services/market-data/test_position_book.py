@@ -0,0 +1,56 @@
+import pytest
+
+from account_book import AccountBook
+from position_book import PositionBook, SymbolBook, quote_currency
+
+
+def book(symbol, contract_size, open_price, usd_rate, leverage=100):
+    accounts = AccountBook()
+    accounts.load([('acct', 10000, leverage)])
+    rows = [('pos', 'acct', 'BUY', 1, open_price, None, None, open_price, 0)]
+    positions = SymbolBook(symbol, contract_size, rows, [0], usd_rate)
+    return accounts.position_margin(positions.account_idx, positions.notional)[0]
+
+
+def test_quote_currency():
+    assert quote_currency('USDJPY') == 'JPY'
+    assert quote_currency('EURUSD') == 'USD'
+    assert quote_currency('SILVER') == 'USD'
+    assert quote_currency('NIKKEI') == 'JPY'
+
+
+def test_usd_base_pair_margin_is_in_usd():
+    # One lot of USDJPY is 100,000 USD; at 1:100 that is 1,000 of margin, not 148,000
+    assert book('USDJPY', 100000, 148.45, 1 / 148.45) == pytest.approx(1000.0)
+
+
+def test_usd_quoted_margin():
+    assert book('EURUSD', 100000, 1.085, 1.0) == pytest.approx(1085.0)
+
+
+def test_cross_margin_is_converted_through_the_quote_currency():
+    # 100,000 EUR at 161 JPY is 16.1M JPY, which at 148.45 JPY per USD is about 108,456 USD
+    assert book('EURJPY', 100000, 161.0, 1 / 148.45) == pytest.approx(161.0 * 100000 / 148.45 / 100)
+
+
+def stopped_out_book():
+    """One account at a 10% margin level, holding a losing EURUSD position"""
+    positions = PositionBook(lambda symbol: 100000)
+    positions.accounts.load([('acct', 1000, 100)])
+    book = SymbolBook('EURUSD', 100000, [('pos', 'acct', 'BUY', 1, 1.1, None, None, 1.1, 0)], [0])
+    positions.books['EURUSD'] = book
+    positions.account_positions = {0: [(book, 0)]}
+    book.margin = positions.accounts.position_margin(book.account_idx, book.notional)
+    positions.accounts.add_positions(book.account_idx, book.profit, book.notional)
+    positions.revalue('EURUSD', 1.09, 1.0901)
+    return positions
+
+
+def test_stop_out_closes_the_losing_position(caplog):
+    assert stopped_out_book().stop_outs() == [('EURUSD', 'pos', 1.09)]
+    assert 'Stop out' in caplog.text
+
+
+def test_stop_out_on_another_workers_symbols_is_not_logged(caplog):
+    assert stopped_out_book().stop_outs(symbols={'GBPUSD'}) == []
+    assert 'Stop out' not in caplog.text
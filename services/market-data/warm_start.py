@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Warm-start snapshots of the in-memory caches
+Quotes, last-update times, the providers' bar rings and client interest are
+written to a local file periodically and on shutdown, and read back at
+startup so a restarted service can answer before its first upstream fetch
+"""
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from bar_buffer import BarRing
+from quote_record import Quote, QuoteSnapshot
+
+WARM_START_INTERVAL = float(os.getenv('WARM_START_INTERVAL', '60'))
+WARM_START_MAX_AGE = float(os.getenv('WARM_START_MAX_AGE', '900'))
+
+VERSION = 1
+RING_COLUMNS = ('ts', 'open', 'high', 'low', 'close', 'volume')
+
+logger = logging.getLogger(__name__)
+
+
+def default_path(service):
+    """WARM_START_PATH, or <service>.warm.npz; an empty WARM_START_PATH disables snapshots"""
+    return os.getenv('WARM_START_PATH', f'{service}.warm.npz')
+
+
+class WarmStart:
+    """
+    Saves and restores one service's caches as a single .npz file
+
+    WARM_START_PATH      snapshot file (default <service>.warm.npz, empty disables)
+    WARM_START_INTERVAL  seconds between periodic snapshots (default 60)
+    WARM_START_MAX_AGE   snapshots, and quotes within them, older than this are ignored (default 900)
+
+    Restored quotes keep their original timestamps and last-update times, so the
+    usual freshness rules decide whether they are served or refreshed first.
+    Bar rings are restored unless their newest bar is over a day old, which the
+    providers would discard anyway; the next fetch is then incremental.
+    """
+
+    def __init__(self, path, interval=WARM_START_INTERVAL, max_age=WARM_START_MAX_AGE, clock=time.time):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.clock = clock
+        self.last_save = clock()
+
+    @classmethod
+    def for_service(cls, service):
+        path = default_path(service)
+        return cls(path) if path else None
+
+    def due(self):
+        return self.clock() - self.last_save >= self.interval
+
+    def save(self, quotes, last_update, prices=None, subscriptions=None):
+        """Write the snapshot atomically; quotes is {symbol: Quote}, last_update {symbol: epoch seconds}"""
+        self.last_save = self.clock()
+        items = [(symbol, quote) for symbol, quote in dict(quotes).items() if isinstance(quote, Quote)]
+        snapshot = QuoteSnapshot.from_quotes(items)
+        updated = dict(last_update)
+        arrays = {
+            'quote_symbols': np.array(snapshot.symbols, dtype=str),
+            'quote_bid': snapshot.bid,
+            'quote_ask': snapshot.ask,
+            'quote_high': snapshot.high,
+            'quote_low': snapshot.low,
+            'quote_volume': snapshot.volume,
+            'quote_ts': snapshot.ts,
+            'quote_updated': np.array([updated.get(symbol, ts) for symbol, ts in zip(snapshot.symbols, snapshot.ts)],
+                                      dtype=np.float64),
+        }
+
+        ring_keys = []
+        ring_columns = {column: [] for column in RING_COLUMNS}
+        for provider_name, symbol, ring in self._rings(prices):
+            bars = ring.bars()
+            if not len(bars['ts']):
+                continue
+            ring_keys.append((provider_name, symbol, len(bars['ts'])))
+            for column in RING_COLUMNS:
+                ring_columns[column].append(bars[column])
+        for column in RING_COLUMNS:
+            dtype = np.int64 if column == 'ts' else np.float64
+            arrays[f'ring_{column}'] = np.concatenate(ring_columns[column]) if ring_keys else np.empty(0, dtype=dtype)
+
+        meta = {
+            'version': VERSION,
+            'written_at': self.clock(),
+            'rings': ring_keys,
+            'interest': subscriptions.interest_ages() if subscriptions is not None else {},
+        }
+        arrays['meta'] = np.array(json.dumps(meta))
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return len(items)
+
+    def restore(self, quotes, last_update, prices=None, subscriptions=None):
+        """Fill quotes and last_update in place; returns the number of quotes restored"""
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            meta = json.loads(str(arrays['meta']))
+        except Exception as e:
+            logger.warning("Unreadable warm-start snapshot, starting cold", extra={'path': self.path, 'error': str(e)})
+            return 0
+
+        now = self.clock()
+        age = now - meta.get('written_at', 0)
+        if meta.get('version') != VERSION or age > self.max_age:
+            logger.info("Warm-start snapshot too old, starting cold", extra={'path': self.path, 'age_s': round(age, 1)})
+            return 0
+
+        restored = 0
+        for symbol, bid, ask, high, low, volume, ts, updated in zip(
+                arrays['quote_symbols'].tolist(), arrays['quote_bid'].tolist(), arrays['quote_ask'].tolist(),
+                arrays['quote_high'].tolist(), arrays['quote_low'].tolist(), arrays['quote_volume'].tolist(),
+                arrays['quote_ts'].tolist(), arrays['quote_updated'].tolist()):
+            if now - updated > self.max_age or symbol in quotes:
+                continue
+            quotes[symbol] = Quote(bid, ask, high, low, int(volume), ts)
+            last_update[symbol] = updated
+            restored += 1
+
+        rings = 0
+        providers = prices.providers if prices is not None else {}
+        offset = 0
+        for provider_name, symbol, count in meta.get('rings', []):
+            columns = [arrays[f'ring_{column}'][offset:offset + count] for column in RING_COLUMNS]
+            offset += count
+            targets = getattr(providers.get(provider_name), 'rings', None)
+            if targets is None or symbol in targets or now - columns[0][-1] > 86400:
+                continue
+            ring = targets[symbol] = BarRing()
+            ring.extend(*columns)
+            rings += 1
+
+        if subscriptions is not None and meta.get('interest'):
+            subscriptions.merge_interest({symbol: seen + age for symbol, seen in meta['interest'].items()})
+
+        logger.info("Restored warm-start snapshot", extra={
+            'path': self.path, 'age_s': round(age, 1), 'quotes': restored, 'rings': rings,
+        })
+        return restored
+
+    @staticmethod
+    def _rings(prices):
+        if prices is None:
+            return
+        for provider in prices.providers.values():
+            for symbol, ring in list(getattr(provider, 'rings', {}).items()):
+                yield provider.name, symbol, ring
@@ -0,0 +1,50 @@
+/*
+  # Add Market Data Shard Leases
+
+  1. New Tables
+    - `market_data_workers`
+      - `worker_id` (text, primary key)
+      - `heartbeat_at` (timestamp)
+      - `started_at` (timestamp)
+
+    - `market_data_symbol_leases`
+      - `symbol` (text, primary key)
+      - `owner` (text)
+      - `expires_at` (timestamp)
+
+  2. Notes
+    - Each market data worker heartbeats its row and renews the leases on the
+      symbols it processes; a lease that is not renewed expires and is taken
+      over by a live worker
+    - Only the service role touches these tables, so RLS is enabled with no
+      user policies
+*/
+
+CREATE TABLE IF NOT EXISTS market_data_workers (
+  worker_id text PRIMARY KEY,
+  heartbeat_at timestamptz NOT NULL DEFAULT now(),
+  started_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS market_data_symbol_leases (
+  symbol text PRIMARY KEY,
+  owner text NOT NULL,
+  expires_at timestamptz NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_market_data_symbol_leases_owner ON market_data_symbol_leases(owner);
+
+ALTER TABLE market_data_workers ENABLE ROW LEVEL SECURITY;
+ALTER TABLE market_data_symbol_leases ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage market_data_workers"
+  ON market_data_workers FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+CREATE POLICY "Service role can manage market_data_symbol_leases"
+  ON market_data_symbol_leases FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
@@ -0,0 +1,27 @@
+/*
+  # Add Market Data Interest
+
+  1. New Tables
+    - `market_data_interest`
+      - `symbol` (text, primary key)
+      - `last_seen_at` (timestamp)
+
+  2. Notes
+    - The live price server records which symbols clients asked for; the market
+      data service polls those at full rate and the rest at a slow refresh
+    - Only the service role touches this table, so RLS is enabled with no user
+      policies
+*/
+
+CREATE TABLE IF NOT EXISTS market_data_interest (
+  symbol text PRIMARY KEY,
+  last_seen_at timestamptz NOT NULL DEFAULT now()
+);
+
+ALTER TABLE market_data_interest ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage market_data_interest"
+  ON market_data_interest FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);